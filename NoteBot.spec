@@ -10,9 +10,17 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # Never imported by the bot but pulled in by hooks or installed in the same venv.
+    # pyarrow is only used by /export parquet; the frozen build offers CSV only.
+    excludes=[
+        'tkinter', 'lib2to3', 'pydoc_data', 'test',
+        'numpy', 'pyarrow',
+        'gigachat', 'speech_recognition', 'pydub', 'soundfile', 'aiogram_calendar', 'pyngrok',
+    ],
     noarchive=False,
-    optimize=0,
+    # Bytecode compiled once at build time with asserts stripped; level 2 would
+    # also drop docstrings, which some dependencies read at runtime
+    optimize=1,
 )
 pyz = PYZ(a.pure)
 
@@ -1,19 +1,52 @@
-from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends
+import asyncio
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, ORJSONResponse
 from pydantic import BaseModel
 from typing import Optional, List
+from urllib.parse import parse_qs
 import json
 import hashlib
 import hmac
 import os
-from database.database import db
+import time
+from database.database import db, is_premium_active
 from config_reader import config
-try:
-    from pyngrok import ngrok
-except ImportError:
-    ngrok = None
+from utils.events import bus, relay, format_sse
+from middlewares.rate_limit import RateLimiter, RateLimitMiddleware
+from utils import metrics, tracing
+from utils.log import setup_logging
+from utils.profiling import watchdog
+from utils.cache import TTLCache
+import logging
 
-app = FastAPI()
+logger = logging.getLogger("api")
+# Seconds a cached user profile is trusted when the bot runs as a separate
+# process without EVENT_RELAY: its premium changes show up only after this
+PROFILE_TTL_WITHOUT_RELAY = 5
+
+# orjson renders task lists several times faster than json.dumps
+app = FastAPI(default_response_class=ORJSONResponse)
+
+def rate_limit_identity(scope) -> Optional[int]:
+    """User id from a valid initData query param, None otherwise (limiter falls back to client IP)."""
+    init_data = parse_qs(scope.get("query_string", b"").decode()).get("initData")
+    if not init_data:
+        return None
+    try:
+        return validate_telegram_data(init_data[0]).get('id')
+    except HTTPException:
+        return None
+
+limiter = RateLimiter(
+    read_rate=config.rate_limit_read_per_sec,
+    read_burst=config.rate_limit_read_burst,
+    write_rate=config.rate_limit_write_per_sec,
+    write_burst=config.rate_limit_write_burst,
+    max_concurrent_writes=config.max_concurrent_writes,
+    on_throttle=lambda route_class, reason: metrics.THROTTLED.labels(route_class, reason).inc(),
+)
+app.add_middleware(RateLimitMiddleware, identify=rate_limit_identity, limiter=limiter, exempt=("/api/health",))
 
 # Allow CORS for Mini App (it runs in iframe)
 app.add_middleware(
@@ -24,18 +57,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(tracing.TracingMiddleware)
+# Outermost, so throttled and CORS-rejected requests are counted too
+app.add_middleware(metrics.MetricsMiddleware)
+
 # Startup: Connect to DB
 @app.on_event("startup")
 async def startup():
+    # In the single-process runtime (run_all.py) the connection is already open
+    # and shared with the bot; only close it on shutdown if we opened it here.
+    app.state.owns_db = db.conn is None
     await db.connect() # Ensure connection is open
-    print("API connected to Database")
+    # No-op under run_all.py, where bot.py has already set logging up
+    setup_logging(config.api_log_file, config.log_level, config.log_levels, config.log_sample,
+                  config.log_max_bytes, config.log_backups)
+    tracing.configure(config.trace_export, config.trace_file, config.trace_otlp_url, config.trace_slow_ms, "notebot-api")
+    logger.info("API connected to Database")
+    if app.state.owns_db and config.event_relay:
+        # Separate from the bot: its events (reminders, tasks added in chat) and
+        # profile changes (premium granted or revoked) come through the database
+        relay.start_inbox(db.conn, db.forget_profile)
+    elif app.state.owns_db:
+        # Nothing tells us about the bot's writes: keep cached profiles short-lived
+        for shard in db.shards:
+            shard.profiles.ttl = PROFILE_TTL_WITHOUT_RELAY
+    # Loop lag metric plus stall stacks in the log (shared with the bot under run_all.py)
+    watchdog.start(config.loop_stall_threshold)
     
     # Auto-start Ngrok removed to avoid conflicts with Serveo (Updated 02:25)
 
 
 @app.on_event("shutdown")
 async def shutdown():
-    await db.close()
+    watchdog.stop()
+    await relay.stop()
+    if app.state.owns_db:
+        await db.close()
 
 # -- Models --
 class TaskCreate(BaseModel):
@@ -48,13 +105,64 @@ class TaskCreate(BaseModel):
 class InitData(BaseModel):
     initData: str
 
+class TaskOut(BaseModel):
+    id: int
+    text: Optional[str]
+    category: Optional[str]
+    created_at: str
+
+class StatusResponse(BaseModel):
+    status: str
+
+class TaskStatusResponse(BaseModel):
+    status: str
+    id: int
+
+class SearchHit(BaseModel):
+    id: int
+    category: Optional[str]
+    status: str
+    created_at: str
+    snippet: str
+
+class SearchResponse(BaseModel):
+    results: List[SearchHit]
+    next_offset: Optional[int] = None
+
+class SettingsOut(BaseModel):
+    timezone: str
+    is_premium: bool
+    premium_until: Optional[str] = None
+
+class MeOut(BaseModel):
+    id: int
+    first_name: Optional[str] = None
+    is_admin: bool
+
 # -- Helpers --
+# Validated initData is cached so the rate limiter and the endpoint share one
+# HMAC. Only successful validations are cached, each until its auth_date gets
+# too old, so a cache hit never outlives the expiry check.
+_init_data_cache = TTLCache(4096, config.init_data_max_age)
+
 def validate_telegram_data(init_data: str) -> dict:
     """
     Validates the initData string from Telegram Web App.
-    Returns the parsed data (user object) if valid.
-    Raises HTTPException if invalid.
+    Returns the parsed data (user object) if valid and its auth_date is
+    within INIT_DATA_MAX_AGE; the dict is the caller's own copy.
+    Raises HTTPException if invalid or expired.
     """
+    user_data = _init_data_cache.get(init_data)
+    if user_data is None:
+        user_data, auth_date = _verify_init_data(init_data)
+        age = max(time.time() - auth_date, 0)
+        if age > config.init_data_max_age:
+            raise HTTPException(status_code=401, detail="initData expired")
+        _init_data_cache.set(init_data, user_data, ttl=config.init_data_max_age - age)
+    return dict(user_data)
+
+def _verify_init_data(init_data: str) -> tuple:
+    """HMAC check of initData -> (user object, auth_date as a unix timestamp)."""
     if not init_data:
          raise HTTPException(status_code=401, detail="No initData provided")
          
@@ -83,11 +191,25 @@ def validate_telegram_data(init_data: str) -> dict:
              
         # Return user data
         user_data = json.loads(parsed_data.get('user', '{}'))
-        return user_data
-        
+        return user_data, int(parsed_data['auth_date'])
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Validation error: {e}")
 
+async def authorize(init_data: str) -> dict:
+    """
+    validate_telegram_data() plus a refusal (409) while the account is being
+    deleted. Counts the user as active today, like bot updates do.
+    """
+    user = validate_telegram_data(init_data)
+    if await db.is_deleting(user['id']):
+        raise HTTPException(status_code=409, detail="Account is being deleted")
+    # Deduplicated per user per day, so at most one write a day per user
+    await db.touch_activity(user['id'])
+    return user
+
 # -- Endpoints --
 
 @app.get("/")
@@ -109,22 +231,29 @@ async def health_check():
         checks["database"] = f"error: {str(e)}"
     
     overall = "ok" if checks["database"] == "ok" else "degraded"
-    return {"status": overall, "checks": checks}
+    return {"status": overall, "checks": checks, "throttled": limiter.stats()}
 
-@app.get("/api/tasks")
-async def get_tasks(initData: str):
-    """Get active tasks for the user."""
-    print(f"DEBUG: API /tasks call with initData length {len(initData)}")
-    user = validate_telegram_data(initData)
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    body, content_type = metrics.render_latest()
+    return Response(body, media_type=content_type)
+
+@app.get("/api/tasks", response_model=List[TaskOut])
+async def get_tasks(initData: str, category: Optional[str] = None):
+    """Get active tasks for the user, optionally only one category."""
+    logger.debug("API /tasks call with initData length %d", len(initData))
+    user = await authorize(initData)
     user_id = user['id']
     
-    tasks = await db.get_user_tasks(user_id)
-    return [{"id": t['id'], "text": t['text'], "category": t['category'], "created_at": t['created_at']} for t in tasks]
+    # Rows come out of the cursor already shaped like TaskOut, so skip
+    # response_model re-validation and hand them straight to orjson.
+    tasks = await db.list_user_tasks(user_id, category)
+    return ORJSONResponse(tasks)
 
-@app.post("/api/tasks")
+@app.post("/api/tasks", response_model=StatusResponse)
 async def create_task(task: TaskCreate, initData: str):
     """Create a new task."""
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     # Use user_id from token, but we can verify it matches body if needed
     # For now just trust the user from token
     user_id = user['id']
@@ -137,88 +266,140 @@ async def create_task(task: TaskCreate, initData: str):
     
     return {"status": "success"}
 
-@app.post("/api/tasks/{task_id}/done")
+@app.post("/api/tasks/{task_id}/done", response_model=TaskStatusResponse)
 async def complete_task(task_id: int, initData: str):
     """Mark task as done."""
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
-    
-    # Ideally check ownership
-    # For MVP assume ID is correct
-    await db.mark_task_done(task_id)
+    # Scoped to the caller: someone else's task id is a no-op
+    await db.mark_task_done(task_id, user_id)
     return {"status": "success", "id": task_id}
 
-@app.delete("/api/tasks/{task_id}")
+@app.delete("/api/tasks/{task_id}", response_model=TaskStatusResponse)
 async def delete_task_endpoint(task_id: int, initData: str):
     """Delete a task."""
-    user = validate_telegram_data(initData)
-    # Check if we have delete_task in DB
+    user = await authorize(initData)
     try:
-        await db.conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-        await db.conn.commit()
+        await db.delete_task(task_id, user['id'])
     except Exception as e:
          raise HTTPException(status_code=500, detail=str(e))
     return {"status": "success", "id": task_id}
 
+@app.get("/api/search", response_model=SearchResponse)
+async def search_tasks(initData: str, q: str, limit: int = 20, offset: int = 0):
+    """Full-text prefix search over the user's tasks, ranked by relevance."""
+    user = await authorize(initData)
+    user_id = user['id']
+
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    results, has_more = await db.search_tasks(user_id, q, limit, offset)
+    return {
+        "results": results,
+        "next_offset": offset + limit if has_more else None
+    }
+
+# -- Live updates (SSE) --
+
+SSE_HEARTBEAT_SECONDS = 15
+
+@app.get("/api/events")
+async def events_stream(initData: str, lastEventId: Optional[str] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-sent events stream of task/reminder/category changes for the user.
+    EventSource sends Last-Event-ID on reconnect; ?lastEventId= works too.
+    """
+    user = await authorize(initData)
+    user_id = user['id']
+    sub = bus.subscribe(user_id, last_event_id or lastEventId)
+
+    async def stream():
+        try:
+            # Tell the browser how fast to reconnect after a drop
+            yield "retry: 3000\n\n"
+            while True:
+                event = await sub.get(timeout=SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": ping\n\n"
+                else:
+                    yield format_sse(event)
+        finally:
+            bus.unsubscribe(sub)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # -- Category Management --
 
-@app.get("/api/categories")
+@app.get("/api/categories", response_model=List[str])
 async def get_categories(initData: str):
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
     cats = await db.get_user_categories(user_id)
-    return cats
+    return ORJSONResponse(cats)
 
-@app.post("/api/categories")
+@app.post("/api/categories", response_model=StatusResponse)
 async def add_category(initData: str, name: str = Form(...)):
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
     await db.add_category(user_id, name)
     return {"status": "success"}
 
-@app.delete("/api/categories/{name}")
+@app.delete("/api/categories/{name}", response_model=StatusResponse)
 async def delete_category(initData: str, name: str):
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
     await db.delete_category(user_id, name)
     return {"status": "success"}
 
+# -- Account --
+
+@app.delete("/api/account", response_model=StatusResponse, status_code=202)
+async def delete_account(initData: str):
+    """Schedule the account for deletion; rows are purged in the background."""
+    user = validate_telegram_data(initData)
+    await db.delete_all_user_data(user['id'])
+    return {"status": "pending"}
+
 # -- Settings --
 
-@app.post("/api/settings/timezone")
+@app.post("/api/settings/timezone", response_model=StatusResponse)
 async def set_timezone(initData: str, timezone: str = Form(...)):
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
     await db.set_timezone(user_id, timezone)
     return {"status": "success"}
 
-@app.get("/api/settings")
+@app.get("/api/settings", response_model=SettingsOut)
 async def get_settings(initData: str):
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
-    user_data = await db.get_user(user_id)
+    user_data = await db.get_user_profile(user_id)
     if not user_data:
          return {"timezone": "UTC", "is_premium": False}
+    premium_until = user_data['premium_until']
     return {
         "timezone": user_data['timezone'],
-        "is_premium": bool(user_data['is_premium']),
-        "premium_until": user_data['premium_until']
+        "is_premium": is_premium_active(premium_until),
+        "premium_until": str(premium_until) if premium_until else None
     }
 
 
 
 # -- Admin & Advanced Features --
 
-@app.get("/api/me")
+@app.get("/api/me", response_model=MeOut)
 async def get_my_info(initData: str):
     """Return user info with admin status."""
-    print(f"DEBUG: API /me call")
-    user = validate_telegram_data(initData)
+    user = await authorize(initData)
     user_id = user['id']
     
     # Check if admin
     is_admin = user_id in config.admin_ids
-    print(f"DEBUG: User {user_id} is_admin={is_admin}")
+    logger.debug("API /me call: user %s is_admin=%s", user_id, is_admin)
     
     return {
         "id": user_id,
@@ -0,0 +1,16 @@
+import asyncio
+from database.database import db
+
+async def main():
+    try:
+        await db.create_tables()
+        print("Rebuilding task search index...")
+        total = await db.rebuild_search_index()
+        print(f"✅ Indexed {total} tasks.")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
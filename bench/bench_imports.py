@@ -0,0 +1,78 @@
+"""
+Import-time audit for the bot and API entry points.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter
+several times per module and reports the median total, then, for the last
+run, self time summed per top-level package and the slowest single modules.
+Use it before adding a dependency or a module-level import: whatever lands
+here is paid on every restart (START_BOT.bat, a crash loop, a deploy).
+
+Usage (from the repo root):
+    python bench/bench_imports.py [module ...] [--runs N] [--top N]
+
+Modules default to `bot` and `api`. Placeholder BOT_TOKEN / ADMIN_IDS are
+set when missing, since config_reader needs them at import.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PLACEHOLDER_ENV = {"BOT_TOKEN": "1:bench", "ADMIN_IDS": "[1]"}
+
+
+def import_times(module: str) -> list:
+    """[(module, self_us, cumulative_us, depth)] from one -X importtime run."""
+    env = {**PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+def report(module: str, runs: int, top: int):
+    totals = []
+    for _ in range(runs):
+        rows = import_times(module)
+        totals.append(next(cumulative for name, _, cumulative, _ in rows if name == module))
+    print(f"\nimport {module}: median {statistics.median(totals) / 1000:.0f} ms "
+          f"(min {min(totals) / 1000:.0f}, max {max(totals) / 1000:.0f}, {runs} runs)")
+
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+    print("  self time by top-level package:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"    {package:<30} {self_us / 1000:8.1f} ms")
+
+    print("  slowest modules (self time):")
+    for name, self_us, cumulative_us, _ in sorted(rows, key=lambda row: row[1], reverse=True)[:top]:
+        print(f"    {name:<50} {self_us / 1000:8.1f} ms   (with imports {cumulative_us / 1000:.1f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=["bot", "api"])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+    for module in args.modules:
+        report(module, args.runs, args.top)
+
+
+if __name__ == "__main__":
+    main()
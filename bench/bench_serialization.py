@@ -0,0 +1,87 @@
+"""
+Micro-benchmark for the /api/tasks response path.
+
+Compares the old path (aiosqlite.Row -> dict per row -> jsonable_encoder ->
+json.dumps, i.e. FastAPI's default JSONResponse) with the current one
+(row factory building dicts straight from the cursor -> orjson).
+Reports best-of-N wall time and peak allocations for 1k and 10k tasks.
+
+Usage (from the repo root):
+    python bench/bench_serialization.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+
+from api import ORJSONResponse
+from database.database import Database
+
+USER_ID = 1
+REPEATS = 20
+
+
+async def legacy_path(db: Database) -> bytes:
+    tasks = await db.get_user_tasks(USER_ID)
+    content = [{"id": t['id'], "text": t['text'], "category": t['category'], "created_at": t['created_at']} for t in tasks]
+    # What starlette's JSONResponse.render does after FastAPI's jsonable_encoder
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+async def current_path(db: Database) -> bytes:
+    tasks = await db.list_user_tasks(USER_ID)
+    return ORJSONResponse(tasks).body
+
+
+async def measure(fn, db: Database):
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        await fn(db)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    await fn(db)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+async def run(n_tasks: int):
+    db = Database(":memory:")
+    await db.create_tables()
+    await db.add_user(USER_ID, "bench")
+    await db.conn.executemany(
+        "INSERT INTO tasks (user_id, text, category_id) "
+        "VALUES (?, ?, (SELECT id FROM categories WHERE user_id IS NULL AND name = ?))",
+        [(USER_ID, f"Задача номер {i}: купить молоко и позвонить маме", "Работа") for i in range(n_tasks)]
+    )
+    await db.conn.commit()
+
+    assert json.loads(await legacy_path(db)) == json.loads(await current_path(db))
+
+    print(f"\n{n_tasks} tasks")
+    results = {}
+    for name, fn in (("legacy (Row + jsonable_encoder + json)", legacy_path), ("current (row factory + orjson)", current_path)):
+        best, peak = await measure(fn, db)
+        results[name] = best
+        print(f"  {name:<42} {best * 1000:8.2f} ms   peak {peak / 1024:8.0f} KiB")
+    legacy, current = results.values()
+    print(f"  speedup: {legacy / current:.1f}x")
+
+    await db.close()
+
+
+async def main():
+    for n in (1000, 10000):
+        await run(n)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,31 +1,37 @@
+import time
+
+# Before the other imports, so the startup log covers them (aiogram alone takes seconds)
+IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 import logging
+from datetime import datetime
 from aiogram import Bot, Dispatcher
 from config_reader import config
 from database.database import db
 from middlewares.auth import AuthMiddleware
+from middlewares.tracing import UpdateTracingMiddleware, HandlerSpanMiddleware, instrument_bot
+from utils import metrics
+from utils.fsm_storage import SQLiteStorage
+from utils.log import setup_logging
+from utils.profiling import StartupTimer, watchdog
+from utils import tracing
+from utils.events import relay
 
 
 
 from handlers import setup, admin, tasks, voice
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("bot.log", encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
-
-import ctypes
+# Log calls only enqueue; a background thread writes bot.log (JSON lines) and the console
+setup_logging(config.log_file, config.log_level, config.log_levels, config.log_sample,
+              config.log_max_bytes, config.log_backups)
 
 def set_console_icon():
     import platform
     if platform.system() != "Windows":
         return
-        
+    import ctypes
+
     try:
         kernel32 = ctypes.WinDLL('kernel32')
         user32 = ctypes.WinDLL('user32')
@@ -69,31 +75,41 @@ def set_console_icon():
         logging.error(f"Failed to set icon exception: {traceback.format_exc()}")
 
 
-async def main():
-    set_console_icon()
-    # Initialize DB
-    await db.create_tables()
-
-    # Initialize Bot and Dispatcher
-    bot = Bot(token=config.bot_token.get_secret_value())
-    dp = Dispatcher()
+def create_dispatcher() -> Dispatcher:
+    # FSM state lives in bot.db so conversations survive restarts
+    storage = SQLiteStorage(db)
+    # Flushes writes and purges idle states from startup on, not from the first write
+    storage.start()
+    dp = Dispatcher(storage=storage)
 
     # Register Middlewares
+    # One trace per update (no-op unless TRACE_EXPORT is set)
+    dp.update.outer_middleware(UpdateTracingMiddleware())
     dp.message.middleware(AuthMiddleware())
     # Callback queries also need auth if we check permissions there, 
     # but for now let's add it to messages. Ideally adding to outer middleware.
     dp.callback_query.middleware(AuthMiddleware())
+    # Registered after auth, so the span covers only the handler itself
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(HandlerSpanMiddleware())
 
     # Register Routers
     dp.include_router(voice.router)
     dp.include_router(setup.router)
     dp.include_router(tasks.router)
     dp.include_router(admin.router)
+    return dp
 
+
+def create_scheduler(bot: Bot):
     from apscheduler.schedulers.asyncio import AsyncIOScheduler
-    from utils.scheduler import check_reminders, check_subscriptions, send_morning_digest, send_marketing_mail
+    from utils.scheduler import (
+        check_reminders, check_subscriptions, send_morning_digest, send_marketing_mail, rollup_daily_stats,
+        compact_database, purge_deleted_accounts, backup_database
+    )
 
     scheduler = AsyncIOScheduler()
+    metrics.observe_scheduler(scheduler)
     scheduler.add_job(check_reminders, 'interval', seconds=60, args=[bot])
     # Run morning digest at 09:00 system time
     scheduler.add_job(send_morning_digest, 'cron', hour=9, minute=0, args=[bot])
@@ -103,10 +119,112 @@ async def main():
     # Note: Logic 2<=days<3 means a 24h window. 12h run means we might alert twice?
     # Yes. Let's stick to 24h.
     scheduler.add_job(check_subscriptions, 'interval', hours=24, args=[bot])
+    # Roll up yesterday's stats shortly after UTC midnight; the first run at startup catches up
+    scheduler.add_job(rollup_daily_stats, 'cron', hour=0, minute=5, timezone='UTC', next_run_time=datetime.now())
+    # Quiet hours: trim sent reminder history and give the space back
+    scheduler.add_job(compact_database, 'cron', hour=3, minute=30, timezone='UTC')
+    # Snapshot after compaction, so backups do not carry the trimmed history
+    scheduler.add_job(backup_database, 'cron', hour=4, minute=0, timezone='UTC')
+    # Account deletions requested by users; the first run resumes any left unfinished
+    scheduler.add_job(purge_deleted_accounts, 'interval', minutes=1, args=[bot], next_run_time=datetime.now())
+    return scheduler
+
+
+async def stop_scheduler(scheduler, timeout: float = 30):
+    """
+    Pause the scheduler and give jobs already running up to `timeout` seconds
+    to finish before shutting it down. AsyncIOScheduler.shutdown() cannot wait
+    for coroutine jobs and cancels them mid-write, and the caller closes the
+    database right after.
+    """
+    if not scheduler.running:
+        return
+    scheduler.pause()
+    running = set(metrics.RUNNING_JOBS)
+    pending = set()
+    if running:
+        logging.info(f"Waiting for {len(running)} scheduler job(s) to finish...")
+        _, pending = await asyncio.wait(running, timeout=timeout)
+        if pending:
+            logging.warning(f"{len(pending)} scheduler job(s) still running after {timeout}s, cancelling them")
+    scheduler.shutdown(wait=False)
+    # shutdown() itself runs on the next loop iteration; then let the
+    # cancelled jobs unwind before the connection goes away
+    await asyncio.sleep(0)
+    await asyncio.gather(*pending, return_exceptions=True)
+
+
+async def run_polling(bot: Bot, dp: Dispatcher):
+    # getUpdates is refused while a webhook is registered
+    await bot.delete_webhook()
+    logging.info("Bot is starting (polling)...")
+    try:
+        await dp.start_polling(bot)
+    finally:
+        await dp.storage.close()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Standalone webhook server: updates are handled concurrently, ordered per chat."""
+    import uvicorn
+    from fastapi import FastAPI
+    from utils.webhook import KeyedUpdateQueue, create_webhook_router
+
+    secret = config.webhook_secret.get_secret_value() if config.webhook_secret else None
+    queue = KeyedUpdateQueue(dp, bot, shards=config.webhook_shards, max_pending=config.webhook_max_pending)
+    app = FastAPI()
+    app.include_router(create_webhook_router(bot, queue, config.webhook_path, secret))
+
+    queue.start()
+    await bot.set_webhook(
+        config.webhook_base_url.rstrip("/") + config.webhook_path,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    server = uvicorn.Server(uvicorn.Config(app, host=config.webhook_host, port=config.webhook_port, log_level="info"))
+    logging.info(f"Bot is starting (webhook on port {config.webhook_port})...")
+    try:
+        await server.serve()
+    finally:
+        await queue.stop()
+        await dp.storage.close()
+        await bot.session.close()
+
+
+async def main():
+    startup = StartupTimer(IMPORT_STARTED)
+    startup.mark("imports")
+    set_console_icon()
+    # Initialize DB
+    await db.create_tables()
+    if config.event_relay and db.shards[0].db_path != ":memory:":
+        # The API runs as its own process here: hand it our events for /api/events
+        relay.start_outbox(db.shards[0])
+    startup.mark("database")
+
+    tracing.configure(config.trace_export, config.trace_file, config.trace_otlp_url, config.trace_slow_ms)
+
+    # Initialize Bot and Dispatcher
+    bot = instrument_bot(Bot(token=config.bot_token.get_secret_value()))
+    dp = create_dispatcher()
+    startup.mark("dispatcher")
+
+    scheduler = create_scheduler(bot)
     scheduler.start()
-    
-    print("Bot is starting...")
-    await dp.start_polling(bot)
+    startup.mark("scheduler")
+
+    if config.metrics_port:
+        metrics.serve(config.metrics_port)
+    watchdog.start(config.loop_stall_threshold)
+    startup.mark("monitoring")
+    logging.info(f"Startup: {startup}")
+
+    if config.bot_mode == "webhook":
+        if config.webhook_base_url:
+            await run_webhook(bot, dp)
+            return
+        logging.error("BOT_MODE=webhook but WEBHOOK_BASE_URL is not set - falling back to polling")
+    await run_polling(bot, dp)
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import SecretStr
-from typing import List
+from typing import Dict, List, Optional
 import os
 from dotenv import load_dotenv
 
@@ -10,8 +10,74 @@ load_dotenv()
 class Settings(BaseSettings):
     bot_token: SecretStr
     admin_ids: List[int]
-    gigachat_auth: SecretStr
+    # No longer used; optional so that .env files still setting GIGACHAT_AUTH
+    # load (unknown .env keys are rejected)
+    gigachat_auth: Optional[SecretStr] = None
     web_app_url: str = "https://komar090.github.io/NoteBotWeb/"
+    # Web App initData is refused once its auth_date is older than this (seconds)
+    init_data_max_age: int = 24 * 60 * 60
+
+    # API rate limits (per user, requests per second / burst size)
+    rate_limit_read_per_sec: float = 10.0
+    rate_limit_read_burst: int = 30
+    rate_limit_write_per_sec: float = 2.0
+    rate_limit_write_burst: int = 10
+    # Global cap on concurrent write requests hitting the SQLite writer
+    max_concurrent_writes: int = 4
+
+    # Local port for the bot's Prometheus metrics (0 disables)
+    metrics_port: int = 9101
+
+    # When bot.py and the API run as separate processes, the bot's change events
+    # (reminders fired, tasks added in chat) reach /api/events through the database,
+    # along with profile changes that evict the API's cached copy of the user
+    event_relay: bool = True
+
+    # API listen address for the single-process runtime (run_all.py)
+    api_host: str = "0.0.0.0"
+    api_port: int = 8000
+
+    # Update delivery: "polling" (default) or "webhook"
+    bot_mode: str = "polling"
+    webhook_base_url: Optional[str] = None  # public https URL Telegram will call
+    webhook_path: str = "/telegram/webhook"
+    webhook_secret: Optional[SecretStr] = None
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8081
+    # Worker shards (updates of one chat always land on the same shard) and
+    # the total number of accepted-but-unprocessed updates before we push back
+    webhook_shards: int = 16
+    webhook_max_pending: int = 1000
+
+    # Sent reminders older than this are deleted by the nightly compaction job
+    reminder_retention_days: int = 30
+
+    # Nightly online snapshots of the database file(s); the newest backup_keep are kept
+    backup_dir: str = "backups"
+    backup_keep: int = 7
+
+    # Logging: JSON lines in log_file (rotated by size) plus the console.
+    # The API writes to api_log_file when it runs as its own process.
+    log_file: str = "bot.log"
+    api_log_file: str = "api.log"
+    log_level: str = "INFO"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backups: int = 5
+    # Per-logger levels, and 1-in-N sampling of the INFO lines of chatty loggers
+    # (the APScheduler executor logs every check_reminders run, aiogram every update)
+    log_levels: Dict[str, str] = {"aiosqlite": "WARNING", "httpx": "WARNING"}
+    log_sample: Dict[str, int] = {"apscheduler.executors.default": 60, "aiogram.event": 10}
+
+    # Event loop stalls longer than this (seconds) are logged with the blocking stack
+    loop_stall_threshold: float = 1.0
+
+    # Tracing of updates, API requests and jobs: "" (off), "file" (JSONL in
+    # trace_file) or "otlp" (OTLP/HTTP JSON to trace_otlp_url). With
+    # trace_slow_ms > 0 only traces at least that slow (or failed) are kept.
+    trace_export: str = ""
+    trace_file: str = "traces.jsonl"
+    trace_otlp_url: str = "http://127.0.0.1:4318/v1/traces"
+    trace_slow_ms: float = 0
 
     model_config = SettingsConfigDict(env_file='.env', env_file_encoding='utf-8', case_sensitive=False)
 
@@ -1,17 +1,134 @@
 import aiosqlite
-from datetime import datetime
+import asyncio
+import contextlib
+import sqlite3
+from datetime import datetime, date, timedelta
 import os
+import re
+import html
 import logging
+from utils.events import bus
+from utils.metrics import instrument_db
+from utils.cache import TTLCache
+from dotenv import load_dotenv
+from database.storage import Storage
 
-class Database:
-    def __init__(self, db_path: str = "bot.db"):
+# Full-text search over tasks. The index folds ё -> е (unicode61 already
+# case-folds Cyrillic) and carries an "owner" token so per-user filtering
+# happens inside FTS5 instead of joining a million rows back to tasks.
+FTS_FOLD = "replace(replace({0}, 'ё', 'е'), 'Ё', 'Е')"
+SEARCH_MAX_TERMS = 8
+
+# Schema changes after the baseline CREATE TABLEs, applied in order by
+# Database._migrate(); PRAGMA user_version holds the number already applied.
+MIGRATIONS = (
+    "_migration_1_categories",
+    "_migration_2_reminder_lifecycle",
+    "_migration_3_account_deletion",
+    "_migration_4_search_backfill",
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# What AuthMiddleware caches per user and injects into handlers as user_profile
+PROFILE_FIELDS = ("id", "premium_until", "timezone", "referred_by")
+
+# Premium is derived from premium_until at read time; the stored is_premium
+# flag is legacy and no longer trusted. Timestamps are stored as
+# 'YYYY-MM-DD HH:MM:SS[.ffffff]' UTC strings, which compare correctly as text.
+PREMIUM_ACTIVE_SQL = "(premium_until IS NOT NULL AND premium_until > datetime('now'))"
+# Accounts scheduled for deletion are invisible everywhere while the
+# background purge removes their rows (see delete_all_user_data)
+LIVE_USER_SQL = "deleting_at IS NULL"
+USER_COLUMNS = (
+    "id, username, timezone, premium_until, created_at, last_promo_sent, trial_used, referred_by, "
+    f"{PREMIUM_ACTIVE_SQL} AS is_premium"
+)
+
+
+def parse_timestamp(value):
+    """SQLite timestamp string (with or without microseconds) -> naive UTC datetime."""
+    if value is None or isinstance(value, datetime):
+        return value
+    # fromisoformat parses both layouts and is far cheaper than strptime in per-row sweeps
+    return datetime.fromisoformat(value)
+
+
+def is_premium_active(premium_until, now: datetime = None) -> bool:
+    """Exact entitlement check against the clock (premium_until is a datetime or None)."""
+    if premium_until is None:
+        return False
+    return premium_until > (now or datetime.utcnow())
+
+
+def _task_out_row(cursor, row):
+    # Row factory for API listings: builds the output dict straight from the
+    # tuple instead of materializing an aiosqlite.Row and copying it later.
+    return {"id": row[0], "text": row[1], "category": row[2], "created_at": row[3]}
+
+@instrument_db
+class Database(Storage):
+    def __init__(self, db_path: str = "bot.db", profile_cache_size: int = 10000, profile_ttl: float = 60):
         self.db_path = db_path
         self.conn = None
+        # user_id -> profile dict (see PROFILE_FIELDS); writes below keep it in sync
+        self.profiles = TTLCache(profile_cache_size, profile_ttl)
+        # Users already recorded in user_activity today
+        self._activity_day = None
+        self._active_today = set()
+
+    @property
+    def shards(self):
+        return [self]
 
     async def connect(self):
         if not self.conn:
-            self.conn = await aiosqlite.connect(self.db_path)
-            self.conn.row_factory = aiosqlite.Row
+            self.conn = await self.open_connection()
+
+    async def open_connection(self) -> aiosqlite.Connection:
+        """A new connection to this file with the usual settings; the caller closes it."""
+        conn = await aiosqlite.connect(self.db_path)
+        conn.row_factory = aiosqlite.Row
+        # Takes effect only on a new, still empty file (so before WAL writes
+        # the header); existing ones are converted offline by vacuum_database.py
+        await conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        # WAL lets readers (a second process, backups) run alongside the
+        # writer; busy_timeout waits for a lock instead of failing at once.
+        await conn.execute("PRAGMA journal_mode = WAL")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        await conn.execute("PRAGMA busy_timeout = 5000")
+        await conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """
+        All-or-nothing work on a dedicated connection: one IMMEDIATE
+        transaction, committed when the block exits, rolled back on error.
+        Other code commits on the shared self.conn whenever it likes, which
+        would also commit half of a multi-statement change made there.
+        An in-memory database only has the shared connection.
+        """
+        if self.db_path == ":memory:":
+            try:
+                yield self.conn
+            except BaseException:
+                await self.conn.rollback()
+                raise
+            await self.conn.commit()
+            return
+
+        conn = await self.open_connection()
+        try:
+            # Take the write lock up front rather than failing halfway through
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                await conn.rollback()
+                raise
+            await conn.commit()
+        finally:
+            await conn.close()
 
     async def close(self):
         if self.conn:
@@ -52,6 +169,9 @@ class Database:
             await self.conn.execute("ALTER TABLE users ADD COLUMN referred_by INTEGER")
         except Exception:
             pass
+
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_premium_until ON users (premium_until)")
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)")
         
         # Tasks table
         await self.conn.execute("""
@@ -90,7 +210,306 @@ class Database:
                 UNIQUE(user_id, name)
             )
         """)
+
+        try:
+            await self.conn.execute("ALTER TABLE tasks ADD COLUMN completed_at TIMESTAMP")
+        except Exception:
+            pass
+
+        # Premium ledger: every grant/revoke; users.premium_until is the running result
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS premium_grants (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                source TEXT,
+                days INTEGER,
+                granted_by INTEGER,
+                premium_until TIMESTAMP,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_premium_grants_user ON premium_grants (user_id, id)")
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_premium_grants_created ON premium_grants (created_at)")
+
+        # Analytics: raw inputs for the daily rollup (see rollup_daily_stats)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_activity (
+                day TEXT,
+                user_id INTEGER,
+                PRIMARY KEY (day, user_id)
+            ) WITHOUT ROWID
+        """)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS stat_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT,
+                user_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_stat_events_created ON stat_events (created_at)")
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats_daily (
+                day TEXT PRIMARY KEY,
+                signups INTEGER DEFAULT 0,
+                active_users INTEGER DEFAULT 0,
+                tasks_created INTEGER DEFAULT 0,
+                tasks_done INTEGER DEFAULT 0,
+                premium_grants INTEGER DEFAULT 0,
+                trials INTEGER DEFAULT 0,
+                referrals INTEGER DEFAULT 0,
+                promos_sent INTEGER DEFAULT 0,
+                retained_d7 INTEGER DEFAULT 0,
+                users_total INTEGER DEFAULT 0,
+                premium_active INTEGER DEFAULT 0,
+                tasks_total INTEGER DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Bus events handed from the bot to a separate API process (utils.events.EventRelay)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS relay_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                type TEXT,
+                payload TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_relay_events_created ON relay_events (created_at)")
+
+        # FSM states (utils.fsm_storage.SQLiteStorage)
+        await self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_states (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_at REAL
+            )
+        """)
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states (updated_at)")
+
+        await self._migrate()
+        await self._create_search_index()
+        await self.conn.commit()
+        await self._check_auto_vacuum()
+
+    async def _check_auto_vacuum(self):
+        """
+        Compaction hands freed pages back to the OS in small steps only with
+        auto_vacuum=INCREMENTAL. Switching an existing file needs a full VACUUM,
+        which would hold the writer for the whole rewrite, so it is left to an
+        offline run of vacuum_database.py; until then compaction only deletes.
+        """
+        if self.db_path != ":memory:" and await self._pragma_value("auto_vacuum") != 2:
+            logging.warning(f"{self.db_path}: auto_vacuum is not INCREMENTAL, compaction will not shrink the file. "
+                            f"Stop the bot and the API and run: python vacuum_database.py")
+
+    async def _migrate(self):
+        async with self.conn.execute("PRAGMA user_version") as cursor:
+            version = (await cursor.fetchone())[0]
+        if version >= len(MIGRATIONS):
+            return
+        # Table rebuilds must not fire foreign key actions; the pragma is a
+        # no-op inside a transaction, so switch it around the whole run.
+        await self.conn.commit()
+        await self.conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            for number, name in enumerate(MIGRATIONS[version:], start=version + 1):
+                logging.info(f"Applying schema migration {number}: {name}")
+                await self.conn.execute("BEGIN")
+                try:
+                    await getattr(self, name)()
+                    await self.conn.execute(f"PRAGMA user_version = {number}")
+                    await self.conn.commit()
+                except Exception:
+                    await self.conn.rollback()
+                    raise
+        finally:
+            await self.conn.execute("PRAGMA foreign_keys = ON")
+
+        async with self.conn.execute("PRAGMA foreign_key_check") as cursor:
+            violations = await cursor.fetchall()
+        if violations:
+            logging.warning(f"Schema migrated with {len(violations)} foreign key violations left, e.g. {tuple(violations[0])}")
+
+    async def _migration_1_categories(self):
+        """
+        tasks.category (free text) -> tasks.category_id. Built-in categories are
+        shared rows with user_id NULL; names only used by tasks become the
+        owner's custom categories.
+        """
+        from keyboards.task_kb import categories as builtin_categories
+
+        await self.conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_categories_builtin ON categories (name) WHERE user_id IS NULL"
+        )
+        await self.conn.executemany(
+            "INSERT OR IGNORE INTO categories (user_id, name) VALUES (NULL, ?)", [(name,) for name in builtin_categories]
+        )
+        # The search triggers read tasks.category; they are recreated by _create_search_index
+        await self.conn.execute("DROP TRIGGER IF EXISTS tasks_fts_ai")
+        await self.conn.execute("DROP TRIGGER IF EXISTS tasks_fts_au")
+
+        await self.conn.execute("ALTER TABLE tasks ADD COLUMN category_id INTEGER REFERENCES categories (id) ON DELETE SET NULL")
+        await self.conn.execute("""
+            INSERT OR IGNORE INTO categories (user_id, name)
+            SELECT DISTINCT user_id, category FROM tasks
+            WHERE category IS NOT NULL AND category != ''
+              AND category NOT IN (SELECT name FROM categories WHERE user_id IS NULL)
+        """)
+        await self.conn.execute("""
+            UPDATE tasks SET category_id = COALESCE(
+                (SELECT id FROM categories c WHERE c.user_id = tasks.user_id AND c.name = tasks.category),
+                (SELECT id FROM categories c WHERE c.user_id IS NULL AND c.name = tasks.category)
+            )
+            WHERE category IS NOT NULL AND category != ''
+        """)
+        if sqlite3.sqlite_version_info >= (3, 35, 0):
+            await self.conn.execute("ALTER TABLE tasks DROP COLUMN category")
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_category ON tasks (user_id, category_id)")
+
+    async def _migration_2_reminder_lifecycle(self):
+        """
+        Reminders die with their task (ON DELETE CASCADE) and pending ones are
+        cancelled when the task is done; existing orphans are cleaned up once.
+        """
+        # Parents first: tasks created through the API before the user ever
+        # opened the bot get a placeholder user row instead of being dropped
+        await self.conn.execute("""
+            INSERT OR IGNORE INTO users (id, username)
+            SELECT DISTINCT user_id, 'Unknown' FROM tasks WHERE user_id NOT IN (SELECT id FROM users)
+        """)
+        cursor = await self.conn.execute("""
+            DELETE FROM reminders
+            WHERE task_id IS NULL
+               OR task_id NOT IN (SELECT id FROM tasks)
+               OR (is_sent = 0 AND task_id IN (SELECT id FROM tasks WHERE status = 'done'))
+        """)
+        logging.info(f"Removed {cursor.rowcount} orphaned or stale reminders")
+
+        # SQLite cannot add a foreign key action to an existing column: rebuild the table
+        await self.conn.execute("""
+            CREATE TABLE reminders_new (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id INTEGER NOT NULL,
+                user_id INTEGER,
+                remind_at TIMESTAMP,
+                type TEXT,
+                recurrence_rule TEXT,
+                is_sent BOOLEAN DEFAULT 0,
+                FOREIGN KEY (task_id) REFERENCES tasks (id) ON DELETE CASCADE,
+                FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            )
+        """)
+        await self.conn.execute("""
+            INSERT INTO reminders_new (id, task_id, user_id, remind_at, type, recurrence_rule, is_sent)
+            SELECT r.id, r.task_id, t.user_id, r.remind_at, r.type, r.recurrence_rule, r.is_sent
+            FROM reminders r JOIN tasks t ON t.id = r.task_id
+        """)
+        await self.conn.execute("DROP TABLE reminders")
+        await self.conn.execute("ALTER TABLE reminders_new RENAME TO reminders")
+
+        # The due scan only walks pending rows; task_id serves the cascade and the trigger
+        await self.conn.execute("CREATE INDEX idx_reminders_pending ON reminders (remind_at) WHERE is_sent = 0")
+        await self.conn.execute("CREATE INDEX idx_reminders_task ON reminders (task_id)")
+        # ON DELETE SET NULL from categories looks tasks up by category_id alone
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_category ON tasks (category_id)")
+        await self.conn.execute("""
+            CREATE TRIGGER tasks_done_cancel_reminders AFTER UPDATE OF status ON tasks
+            WHEN new.status = 'done' BEGIN
+                DELETE FROM reminders WHERE task_id = new.id AND is_sent = 0;
+            END
+        """)
+
+    async def _migration_3_account_deletion(self):
+        await self.conn.execute("ALTER TABLE users ADD COLUMN deleting_at TIMESTAMP")
+        await self.conn.execute("CREATE INDEX idx_users_deleting ON users (deleting_at) WHERE deleting_at IS NOT NULL")
+        # Lets the users -> reminders cascade and the purge find rows without a scan
+        await self.conn.execute("CREATE INDEX idx_reminders_user ON reminders (user_id)")
+
+    async def _migration_4_search_backfill(self):
+        """
+        Index the tasks that predate full-text search, which an upgraded
+        database would otherwise search in an empty tasks_fts. Rebuilt from
+        scratch, as an index left by an earlier partial backfill cannot be told
+        apart cheaply; one transaction, so an interrupted run starts over.
+        """
+        await self._create_search_index()
+        await self.conn.execute("DELETE FROM tasks_fts")
+        text, category = FTS_FOLD.format("t.text"), FTS_FOLD.format("c.name")
+        cursor = await self.conn.execute(
+            f"INSERT INTO tasks_fts (rowid, text, category, owner) "
+            f"SELECT t.id, {text}, {category}, 'u' || t.user_id "
+            f"FROM tasks t LEFT JOIN categories c ON c.id = t.category_id"
+        )
+        await self.conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
+        logging.info(f"Indexed {cursor.rowcount} existing tasks for search")
+
+    async def _create_search_index(self):
+        await self.conn.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+                text, category, owner,
+                tokenize = 'unicode61 remove_diacritics 2'
+            )
+        """)
+        text = FTS_FOLD.format("new.text")
+        category = FTS_FOLD.format("(SELECT name FROM categories WHERE id = new.category_id)")
+        await self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_ai AFTER INSERT ON tasks BEGIN
+                INSERT INTO tasks_fts (rowid, text, category, owner)
+                VALUES (new.id, {text}, {category}, 'u' || new.user_id);
+            END
+        """)
+        await self.conn.execute("""
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_ad AFTER DELETE ON tasks BEGIN
+                DELETE FROM tasks_fts WHERE rowid = old.id;
+            END
+        """)
+        await self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_au AFTER UPDATE OF text, category_id, user_id ON tasks BEGIN
+                UPDATE tasks_fts SET text = {text}, category = {category}, owner = 'u' || new.user_id
+                WHERE rowid = old.id;
+            END
+        """)
+        # A rename is one categories row; only the derived index follows it
+        await self.conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_fts_category_au AFTER UPDATE OF name ON categories BEGIN
+                UPDATE tasks_fts SET category = {FTS_FOLD.format("new.name")}
+                WHERE rowid IN (SELECT id FROM tasks WHERE category_id = new.id);
+            END
+        """)
+
+    async def rebuild_search_index(self, batch_size: int = 5000):
+        """Repopulate tasks_fts from tasks in id-ordered batches. Returns number of indexed rows."""
+        await self.conn.execute("DELETE FROM tasks_fts")
+        await self.conn.commit()
+
+        text, category = FTS_FOLD.format("t.text"), FTS_FOLD.format("c.name")
+        last_id = 0
+        total = 0
+        while True:
+            async with self.conn.execute(
+                "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM tasks WHERE id > ? ORDER BY id LIMIT ?)",
+                (last_id, batch_size)
+            ) as cursor:
+                max_id, count = await cursor.fetchone()
+            if not count:
+                break
+            await self.conn.execute(
+                f"INSERT INTO tasks_fts (rowid, text, category, owner) "
+                f"SELECT t.id, {text}, {category}, 'u' || t.user_id "
+                f"FROM tasks t LEFT JOIN categories c ON c.id = t.category_id WHERE t.id > ? AND t.id <= ?",
+                (last_id, max_id)
+            )
+            await self.conn.commit()
+            last_id = max_id
+            total += count
+
+        await self.conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
         await self.conn.commit()
+        return total
 
     async def add_user(self, user_id: int, username: str):
         # Connection is expected to be open
@@ -101,107 +520,365 @@ class Database:
         await self.conn.commit()
 
     async def get_user(self, user_id: int):
-        async with self.conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)) as cursor:
+        async with self.conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE id = ? AND {LIVE_USER_SQL}", (user_id,)) as cursor:
             return await cursor.fetchone()
 
+    async def get_user_profile(self, user_id: int):
+        """
+        Cached subset of the users row (PROFILE_FIELDS), or None if the user does not exist.
+        premium_until is a parsed datetime; use is_premium_active() to check entitlement.
+        """
+        profile = self.profiles.get(user_id)
+        if profile is not None:
+            return profile
+
+        async with self.conn.execute(
+            f"SELECT {', '.join(PROFILE_FIELDS)} FROM users WHERE id = ? AND {LIVE_USER_SQL}", (user_id,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        profile = dict(row)
+        profile['premium_until'] = parse_timestamp(profile['premium_until'])
+        self.profiles.set(user_id, profile)
+        return profile
+
+    def forget_profile(self, user_id: int):
+        """Drop a cached profile whose row another process has changed (see EventRelay)."""
+        self.profiles.pop(user_id)
+
+    async def ensure_user(self, user_id: int, username: str):
+        """Profile of the user, registering them first if needed. Zero queries on a cache hit."""
+        profile = await self.get_user_profile(user_id)
+        if profile is None:
+            await self.add_user(user_id, username)
+            profile = await self.get_user_profile(user_id)
+        if profile is None:
+            # Account is being purged: callers must not act for it until it is gone
+            profile = {"id": user_id, "premium_until": None, "timezone": "UTC", "referred_by": None, "deleting": True}
+        return profile
+
+    async def is_deleting(self, user_id: int) -> bool:
+        """True while the account is scheduled for deletion. Zero queries for cached (live) users."""
+        if await self.get_user_profile(user_id) is not None:
+            return False
+        async with self.conn.execute(
+            "SELECT 1 FROM users WHERE id = ? AND deleting_at IS NOT NULL", (user_id,)
+        ) as cursor:
+            return await cursor.fetchone() is not None
+
     async def set_timezone(self, user_id: int, timezone: str):
         await self.conn.execute("UPDATE users SET timezone = ? WHERE id = ?", (timezone, user_id))
         await self.conn.commit()
+        self.profiles.update(user_id, timezone=timezone)
+        bus.profile_changed(user_id)
 
-    async def set_premium(self, user_id: int, is_premium: bool, days: int = 31):
-        if is_premium:
-            from datetime import timedelta
-            # Set to now + days
-            utc_now = datetime.utcnow()
-            premium_until = utc_now + timedelta(days=days)
-            await self.conn.execute("UPDATE users SET is_premium = 1, premium_until = ? WHERE id = ?", (premium_until, user_id))
-        else:
-            # Revoke
-            await self.conn.execute("UPDATE users SET is_premium = 0, premium_until = NULL WHERE id = ?", (user_id,))
-            
+    async def _grant(self, user_id: int, days: int, source: str, granted_by: int = None):
+        """
+        Extend premium by `days` from max(premium_until, now) in one UPDATE (no
+        read-modify-write, so concurrent grants add up) and record it in the ledger.
+        Does not commit. Returns the new premium_until, or None if the user does not exist.
+        """
+        async with self.conn.execute(
+            """
+            UPDATE users SET is_premium = 1,
+                premium_until = datetime(MAX(COALESCE(premium_until, ''), datetime('now')), ?)
+            WHERE id = ? RETURNING premium_until
+            """,
+            (f"+{int(days)} days", user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        if not row:
+            return None
+        await self.conn.execute(
+            "INSERT INTO premium_grants (user_id, source, days, granted_by, premium_until) VALUES (?, ?, ?, ?, ?)",
+            (user_id, source, days, granted_by, row['premium_until'])
+        )
+        premium_until = parse_timestamp(row['premium_until'])
+        self.profiles.update(user_id, premium_until=premium_until)
+        return premium_until
+
+    async def grant_premium(self, user_id: int, days: int, source: str = "admin", granted_by: int = None):
+        """Add premium time. source: 'trial', 'referral', 'admin' or 'payment'."""
+        premium_until = await self._grant(user_id, days, source, granted_by)
         await self.conn.commit()
+        bus.profile_changed(user_id)
+        return premium_until
 
-    async def activate_trial(self, user_id: int):
-        from datetime import timedelta
-        utc_now = datetime.utcnow()
-        premium_until = utc_now + timedelta(days=3)
+    async def set_premium(self, user_id: int, is_premium: bool, days: int = 31, granted_by: int = None):
+        if is_premium:
+            # Extends existing paid time instead of overwriting it
+            return await self.grant_premium(user_id, days, "admin", granted_by)
+
+        # Revoke
+        await self.conn.execute("UPDATE users SET is_premium = 0, premium_until = NULL WHERE id = ?", (user_id,))
         await self.conn.execute(
-            "UPDATE users SET is_premium = 1, premium_until = ?, trial_used = 1 WHERE id = ?",
-            (premium_until, user_id)
+            "INSERT INTO premium_grants (user_id, source, days, granted_by, premium_until) VALUES (?, 'revoke', 0, ?, NULL)",
+            (user_id, granted_by)
         )
         await self.conn.commit()
+        self.profiles.update(user_id, premium_until=None)
+        bus.profile_changed(user_id)
+
+    async def activate_trial(self, user_id: int, days: int = 3):
+        await self.conn.execute("UPDATE users SET trial_used = 1 WHERE id = ?", (user_id,))
+        premium_until = await self._grant(user_id, days, "trial")
+        await self.conn.commit()
+        bus.profile_changed(user_id)
+        return premium_until
 
     async def add_referral(self, user_id: int, referrer_id: int):
-        # Update referred_by for the new user
-        await self.conn.execute("UPDATE users SET referred_by = ? WHERE id = ?", (referrer_id, user_id))
-        
-        # Reward the referrer: +3 days of premium
-        from datetime import timedelta
-        
-        # Check if referrer already has premium
-        async with self.conn.execute("SELECT is_premium, premium_until FROM users WHERE id = ?", (referrer_id,)) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                is_premium = row['is_premium']
-                premium_until_raw = row['premium_until']
-                
-                new_until = None
-                if is_premium and premium_until_raw:
-                    # Extend
-                    if isinstance(premium_until_raw, str):
-                        fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in premium_until_raw else '%Y-%m-%d %H:%M:%S'
-                        current_until = datetime.strptime(premium_until_raw, fmt)
-                    else:
-                        current_until = premium_until_raw
-                    new_until = current_until + timedelta(days=3)
-                else:
-                    # New premium
-                    new_until = datetime.utcnow() + timedelta(days=3)
-                
-                await self.conn.execute(
-                    "UPDATE users SET is_premium = 1, premium_until = ? WHERE id = ?",
-                    (new_until, referrer_id)
-                )
-        
+        # Only the first referral counts; the WHERE makes a repeated /start a no-op
+        cursor = await self.conn.execute(
+            "UPDATE users SET referred_by = ? WHERE id = ? AND referred_by IS NULL", (referrer_id, user_id)
+        )
+        if cursor.rowcount:
+            # Reward the referrer: +3 days of premium
+            await self._grant(referrer_id, 3, "referral")
         await self.conn.commit()
+        if cursor.rowcount:
+            self.profiles.update(user_id, referred_by=referrer_id)
+            bus.profile_changed(user_id)
+            bus.profile_changed(referrer_id)
+
+    async def _set_referrer(self, user_id: int, referrer_id: int) -> bool:
+        """First half of add_referral() for a referrer stored in another shard."""
+        cursor = await self.conn.execute(
+            "UPDATE users SET referred_by = ? WHERE id = ? AND referred_by IS NULL", (referrer_id, user_id)
+        )
+        await self.conn.commit()
+        if cursor.rowcount:
+            self.profiles.update(user_id, referred_by=referrer_id)
+            bus.profile_changed(user_id)
+        return bool(cursor.rowcount)
+
+    async def get_premium_grants(self, user_id: int, limit: int = 10):
+        """Newest ledger entries first."""
+        async with self.conn.execute(
+            "SELECT source, days, granted_by, premium_until, created_at FROM premium_grants "
+            "WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+            (user_id, limit)
+        ) as cursor:
+            return await cursor.fetchall()
 
     # Task methods
+    async def _category_id(self, user_id: int, name: str, create: bool = False):
+        """The user's own category wins over a built-in one with the same name."""
+        if not name:
+            return None
+        async with self.conn.execute(
+            """
+            SELECT COALESCE(
+                (SELECT id FROM categories WHERE user_id = ? AND name = ?),
+                (SELECT id FROM categories WHERE user_id IS NULL AND name = ?)
+            )
+            """,
+            (user_id, name, name)
+        ) as cursor:
+            category_id = (await cursor.fetchone())[0]
+        if category_id is None and create:
+            async with self.conn.execute(
+                "INSERT INTO categories (user_id, name) VALUES (?, ?) RETURNING id", (user_id, name)
+            ) as cursor:
+                category_id = (await cursor.fetchone())[0]
+        return category_id
+
     async def add_task(self, user_id: int, text: str, category: str):
+        # tasks.user_id is a foreign key; API users may not have opened the bot yet
+        await self.conn.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, 'Unknown')", (user_id,))
+        category_id = await self._category_id(user_id, category, create=True)
         cursor = await self.conn.execute(
-            "INSERT INTO tasks (user_id, text, category) VALUES (?, ?, ?)",
-            (user_id, text, category)
+            "INSERT INTO tasks (user_id, text, category_id) VALUES (?, ?, ?)",
+            (user_id, text, category_id)
         )
         await self.conn.commit()
+        bus.publish(user_id, "task_created", {"id": cursor.lastrowid, "text": text, "category": category})
         return cursor.lastrowid
 
     async def add_reminder(self, task_id: int, user_id: int, remind_at: datetime, type: str = "once", recurrence_rule: str = None):
-        await self.conn.execute(
-            "INSERT INTO reminders (task_id, user_id, remind_at, type, recurrence_rule) VALUES (?, ?, ?, ?, ?)",
-            (task_id, user_id, remind_at, type, recurrence_rule)
+        # Only for live tasks: a recurring reminder rescheduled after its task was
+        # completed or deleted would otherwise come back
+        cursor = await self.conn.execute(
+            "INSERT INTO reminders (task_id, user_id, remind_at, type, recurrence_rule) "
+            "SELECT ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM tasks WHERE id = ? AND status = 'active')",
+            (task_id, user_id, remind_at, type, recurrence_rule, task_id)
         )
         await self.conn.commit()
+        if not cursor.rowcount:
+            return
+        bus.publish(user_id, "reminder_created", {"task_id": task_id, "remind_at": remind_at, "recurrence_rule": recurrence_rule})
 
     async def get_active_reminders(self):
         query = """
             SELECT reminders.*, tasks.text 
             FROM reminders 
             JOIN tasks ON reminders.task_id = tasks.id 
-            WHERE is_sent = 0 AND remind_at <= CURRENT_TIMESTAMP
+            WHERE reminders.is_sent = 0 AND reminders.remind_at <= CURRENT_TIMESTAMP
         """
         async with self.conn.execute(query) as cursor:
                 return await cursor.fetchall()
 
-    async def mark_reminder_sent(self, reminder_id: int):
-        await self.conn.execute("UPDATE reminders SET is_sent = 1 WHERE id = ?", (reminder_id,))
+    async def _pragma_value(self, name: str) -> int:
+        async with self.conn.execute(f"PRAGMA {name}") as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def compact_reminders(self, retention_days: int = 30, batch_size: int = 500,
+                                pause: float = 0.05, vacuum_step: int = 1000) -> dict:
+        """
+        Delete sent reminders older than the retention window, then return the
+        freed pages to the OS and refresh planner statistics.
+        Works in short id-ordered batches with a pause between them, so the
+        single writer is never held for long.
+        Returns {"deleted", "reclaimed_bytes", "size_bytes"}.
+        """
+        page_size = await self._pragma_value("page_size")
+        pages_before = await self._pragma_value("page_count")
+
+        deleted = 0
+        last_id = 0
+        while True:
+            async with self.conn.execute(
+                """
+                SELECT id FROM reminders
+                WHERE id > ? AND is_sent = 1 AND remind_at < datetime('now', ?)
+                ORDER BY id LIMIT ?
+                """,
+                (last_id, f"-{int(retention_days)} days", batch_size)
+            ) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                break
+            await self.conn.execute(f"DELETE FROM reminders WHERE id IN ({','.join('?' * len(ids))})", ids)
+            await self.conn.commit()
+            deleted += len(ids)
+            last_id = ids[-1]
+            await asyncio.sleep(pause)
+
+        incremental = await self._pragma_value("auto_vacuum") == 2
+        if not incremental:
+            logging.warning(f"{self.db_path}: auto_vacuum is not INCREMENTAL, freed pages stay in the file "
+                            f"(run vacuum_database.py offline)")
+        while incremental and await self._pragma_value("freelist_count"):
+            # Each step of the statement frees one page, so drain the cursor
+            async with self.conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_step)})") as cursor:
+                await cursor.fetchall()
+            await self.conn.commit()
+            await asyncio.sleep(pause)
+
+        # Bounded ANALYZE: samples large indexes instead of reading them fully
+        await self.conn.execute("PRAGMA analysis_limit = 1000")
+        await self.conn.execute("ANALYZE")
+        await self.conn.commit()
+
+        pages_after = await self._pragma_value("page_count")
+        return {
+            "deleted": deleted,
+            "reclaimed_bytes": max(pages_before - pages_after, 0) * page_size,
+            "size_bytes": pages_after * page_size,
+        }
+
+    async def mark_reminder_sent(self, reminder_id: int, user_id: int = None):
+        if user_id is None:
+            await self.conn.execute("UPDATE reminders SET is_sent = 1 WHERE id = ?", (reminder_id,))
+        else:
+            await self.conn.execute("UPDATE reminders SET is_sent = 1 WHERE id = ? AND user_id = ?", (reminder_id, user_id))
         await self.conn.commit()
 
     async def get_user_tasks(self, user_id: int):
-        async with self.conn.execute("SELECT * FROM tasks WHERE user_id = ? AND status = 'active' ORDER BY created_at DESC", (user_id,)) as cursor:
+        async with self.conn.execute(
+            "SELECT t.*, c.name AS category FROM tasks t LEFT JOIN categories c ON c.id = t.category_id "
+            "WHERE t.user_id = ? AND t.status = 'active' ORDER BY t.created_at DESC",
+            (user_id,)
+        ) as cursor:
             return await cursor.fetchall()
             
-    async def mark_task_done(self, task_id: int):
-        await self.conn.execute("UPDATE tasks SET status = 'done' WHERE id = ?", (task_id,))
+    async def list_user_tasks(self, user_id: int, category: str = None):
+        """
+        Active tasks as plain dicts (id, text, category, created_at), ready for JSON.
+        A category filter is resolved to its id once and matched on idx_tasks_user_category.
+        """
+        sql = (
+            "SELECT t.id, t.text, c.name, t.created_at FROM tasks t LEFT JOIN categories c ON c.id = t.category_id "
+            "WHERE t.user_id = ? AND t.status = 'active'"
+        )
+        params = [user_id]
+        if category:
+            category_id = await self._category_id(user_id, category)
+            if category_id is None:
+                return []
+            sql += " AND t.category_id = ?"
+            params.append(category_id)
+        async with self.conn.execute(sql + " ORDER BY t.created_at DESC", params) as cursor:
+            cursor.row_factory = _task_out_row
+            return await cursor.fetchall()
+
+    async def get_user_tasks_page(self, user_id: int, offset: int, limit: int):
+        """Active tasks newest first (id, text, created date); up to limit + 1 rows."""
+        async with self.conn.execute(
+            "SELECT id, text, date(created_at) AS created FROM tasks WHERE user_id = ? AND status = 'active' "
+            "ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (user_id, limit + 1, offset)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def mark_task_done(self, task_id: int, user_id: int = None):
+        """With user_id, only the owner's task is touched."""
+        async with self.conn.execute(
+            "UPDATE tasks SET status = 'done', completed_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND user_id = COALESCE(?, user_id) RETURNING user_id",
+            (task_id, user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        await self.conn.commit()
+        if row:
+            bus.publish(row['user_id'], "task_done", {"id": task_id})
+
+    async def delete_task(self, task_id: int, user_id: int = None):
+        async with self.conn.execute(
+            "DELETE FROM tasks WHERE id = ? AND user_id = COALESCE(?, user_id) RETURNING user_id", (task_id, user_id)
+        ) as cursor:
+            row = await cursor.fetchone()
         await self.conn.commit()
+        if row:
+            bus.publish(row['user_id'], "task_deleted", {"id": task_id})
+
+    async def search_tasks(self, user_id: int, query: str, limit: int = 20, offset: int = 0):
+        """
+        Prefix search over the user's task text and category, best matches first.
+        Returns (rows, has_more); each row has an HTML-safe 'snippet' with <b> highlights.
+        """
+        terms = re.findall(r"\w+", query.replace("ё", "е").replace("Ё", "Е"))[:SEARCH_MAX_TERMS]
+        if not terms:
+            return [], False
+
+        # The user's terms are scoped to text/category: unscoped, "u1" or a digit
+        # prefix would also match the owner token and return every task they have
+        match = f"owner : u{int(user_id)} AND {{text category}} : (" + " ".join(f'"{t}"*' for t in terms) + ")"
+        sql = """
+            SELECT tasks.id, categories.name AS category, tasks.status, tasks.created_at,
+                   snippet(tasks_fts, 0, char(2), char(3), '…', 12) AS snippet
+            FROM tasks_fts
+            JOIN tasks ON tasks.id = tasks_fts.rowid
+            LEFT JOIN categories ON categories.id = tasks.category_id
+            WHERE tasks_fts MATCH ?
+            ORDER BY bm25(tasks_fts, 10.0, 2.0, 0.0)
+            LIMIT ? OFFSET ?
+        """
+        # Fetch one extra row to know whether there is a next page without COUNT(*)
+        async with self.conn.execute(sql, (match, limit + 1, offset)) as cursor:
+            rows = await cursor.fetchall()
+
+        results = [
+            {
+                "id": row['id'],
+                "category": row['category'],
+                "status": row['status'],
+                "created_at": row['created_at'],
+                "snippet": html.escape(row['snippet'] or "").replace("\x02", "<b>").replace("\x03", "</b>"),
+            }
+            for row in rows[:limit]
+        ]
+        return results, len(rows) > limit
 
     async def get_user_stats(self, user_id: int):
         # Total tasks
@@ -214,23 +891,76 @@ class Database:
             
         return {"total": total, "done": done}
 
-    async def delete_all_user_data(self, user_id: int):
-        # Delete related reminders first
-        await self.conn.execute("DELETE FROM reminders WHERE user_id = ?", (user_id,))
+    async def delete_all_user_data(self, user_id: int) -> bool:
+        """
+        Schedule the account for deletion. The user disappears from all queries
+        immediately; purge_account() removes the rows later in small batches.
+        Returns False if deletion was already scheduled.
+        """
+        await self.conn.execute("INSERT OR IGNORE INTO users (id, username) VALUES (?, 'Unknown')", (user_id,))
+        cursor = await self.conn.execute(
+            "UPDATE users SET deleting_at = CURRENT_TIMESTAMP WHERE id = ? AND deleting_at IS NULL", (user_id,)
+        )
+        # Nothing should fire for this user while the purge runs
+        await self.conn.execute("DELETE FROM reminders WHERE user_id = ? AND is_sent = 0", (user_id,))
+        await self.conn.commit()
+        self.profiles.pop(user_id)
+        bus.profile_changed(user_id)
+        if cursor.rowcount:
+            bus.publish(user_id, "account_deleting", {})
+        return bool(cursor.rowcount)
+
+    async def get_pending_deletions(self):
+        async with self.conn.execute(
+            "SELECT id FROM users WHERE deleting_at IS NOT NULL ORDER BY deleting_at"
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def purge_account(self, user_id: int, batch_size: int = 500, pause: float = 0.05) -> int:
+        """
+        Delete a scheduled account: tasks (with their reminders) in committed
+        batches, then the remaining small tables and the users row. Every batch
+        stands on its own, so an interrupted purge simply continues on the next run.
+        Analytics rows (user_activity, stat_events) and the premium ledger keep
+        only the numeric id and are left in place. Returns the number of tasks removed.
+        """
+        return await self._remove_user_rows(user_id, batch_size, pause, "deleting_at IS NOT NULL")
+
+    async def _remove_user_rows(self, user_id: int, batch_size: int, pause: float, user_filter: str = "1") -> int:
+        """Batched delete of a user's tasks, reminders and categories, then of the users row if user_filter holds."""
+        removed = 0
+        while True:
+            async with self.conn.execute(
+                "SELECT id FROM tasks WHERE user_id = ? LIMIT ?", (user_id, batch_size)
+            ) as cursor:
+                ids = [row[0] for row in await cursor.fetchall()]
+            if not ids:
+                break
+            marks = ",".join("?" * len(ids))
+            await self.conn.execute(f"DELETE FROM reminders WHERE task_id IN ({marks})", ids)
+            await self.conn.execute(f"DELETE FROM tasks WHERE id IN ({marks})", ids)
+            await self.conn.commit()
+            removed += len(ids)
+            await asyncio.sleep(pause)
+
+        # Whatever slipped in since the last batch goes in the same transaction as the user row
         await self.conn.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
-        # Also could delete categories, but optional. Let's keep them or delete?
-        # Let's delete custom categories too for full cleanup
         await self.conn.execute("DELETE FROM categories WHERE user_id = ?", (user_id,))
+        await self.conn.execute(f"DELETE FROM users WHERE id = ? AND {user_filter}", (user_id,))
         await self.conn.commit()
+        self.profiles.pop(user_id)
+        bus.profile_changed(user_id)
+        return removed
 
     async def add_category(self, user_id: int, name: str):
         # Check if exists to avoid duplicates (unique constraint or check)
         # We'll just insert regular
         await self.conn.execute("INSERT OR IGNORE INTO categories (user_id, name) VALUES (?, ?)", (user_id, name))
         await self.conn.commit()
+        bus.publish(user_id, "category_added", {"name": name})
 
     async def get_user_categories(self, user_id: int):
-        async with self.conn.execute("SELECT name FROM categories WHERE user_id = ?", (user_id,)) as cursor:
+        async with self.conn.execute("SELECT name FROM categories WHERE user_id = ? ORDER BY id", (user_id,)) as cursor:
             rows = await cursor.fetchall()
             return [row[0] for row in rows]
     
@@ -240,7 +970,209 @@ class Database:
 
 
     async def get_all_users(self):
-        async with self.conn.execute("SELECT * FROM users") as cursor:
+        async with self.conn.execute(f"SELECT {USER_COLUMNS} FROM users WHERE {LIVE_USER_SQL}") as cursor:
+            return await cursor.fetchall()
+
+    async def get_users_page(self, offset: int, limit: int):
+        """
+        Newest users first, with days since signup computed in SQL.
+        Returns up to limit + 1 rows so the caller can tell whether a next page exists.
+        """
+        async with self.conn.execute(
+            f"""
+            SELECT id, username, trial_used, {PREMIUM_ACTIVE_SQL} AS is_premium,
+                   CAST(julianday('now') - julianday(created_at) AS INTEGER) AS days
+            FROM users WHERE {LIVE_USER_SQL} ORDER BY id DESC LIMIT ? OFFSET ?
+            """,
+            (limit + 1, offset)
+        ) as cursor:
+            return await cursor.fetchall()
+
+    async def find_users(self, query: str = "", status: str = None, limit: int = 20):
+        """
+        Admin user search in one indexed query.
+        query: numeric -> exact id; otherwise a case-insensitive username prefix
+        (a leading @ is ignored). status: 'premium', 'free', 'trial' or None.
+        """
+        query = (query or "").strip().lstrip("@")
+        where, params, order = [LIVE_USER_SQL], [], "id DESC"
+        if query.isdigit():
+            where.append("id = ?")
+            params.append(int(query))
+        elif query:
+            # Range over idx_users_username_nocase instead of LIKE, which
+            # cannot use an index here
+            where.append("username >= ? COLLATE NOCASE AND username < ? COLLATE NOCASE")
+            params += [query, query + "\U0010ffff"]
+            order = "username COLLATE NOCASE"
+
+        if status == "premium":
+            where.append(PREMIUM_ACTIVE_SQL)
+        elif status == "free":
+            where.append(f"NOT {PREMIUM_ACTIVE_SQL}")
+        elif status == "trial":
+            where.append(f"trial_used = 1 AND {PREMIUM_ACTIVE_SQL}")
+
+        sql = f"SELECT {USER_COLUMNS} FROM users WHERE " + " AND ".join(where) + f" ORDER BY {order} LIMIT ?"
+        async with self.conn.execute(sql, (*params, limit)) as cursor:
+            return await cursor.fetchall()
+
+    async def _log_event(self, kind: str, user_id: int):
+        """Append to stat_events; committed together with the caller's change."""
+        await self.conn.execute("INSERT INTO stat_events (kind, user_id) VALUES (?, ?)", (kind, user_id))
+
+    async def touch_activity(self, user_id: int):
+        """Mark the user active today (UTC). Writes at most once per user per day."""
+        day = datetime.utcnow().date().isoformat()
+        if day != self._activity_day:
+            self._activity_day, self._active_today = day, set()
+        if user_id in self._active_today:
+            return
+        self._active_today.add(user_id)
+        await self.conn.execute("INSERT OR IGNORE INTO user_activity (day, user_id) VALUES (?, ?)", (day, user_id))
+        await self.conn.commit()
+
+    async def _count_per_day(self, sql: str, lo: str, hi: str) -> dict:
+        async with self.conn.execute(sql, (lo, hi)) as cursor:
+            return {row[0]: row[1] for row in await cursor.fetchall()}
+
+    async def rollup_daily_stats(self, until: date = None, since: date = None) -> int:
+        """
+        Aggregate complete UTC days into stats_daily, one GROUP BY pass per source table.
+        Continues after the last rolled-up day (or from the first signup) up to
+        `until` (default: yesterday); `since` forces recomputation from that day.
+        Returns the number of days written.
+        """
+        until = until or datetime.utcnow().date() - timedelta(days=1)
+        if since is None:
+            async with self.conn.execute("SELECT MAX(day) FROM stats_daily") as cursor:
+                last = (await cursor.fetchone())[0]
+            if last:
+                since = date.fromisoformat(last) + timedelta(days=1)
+            else:
+                async with self.conn.execute("SELECT date(MIN(created_at)) FROM users") as cursor:
+                    first = (await cursor.fetchone())[0]
+                since = date.fromisoformat(first) if first else until
+        if since > until:
+            return 0
+
+        lo, hi = since.isoformat(), (until + timedelta(days=1)).isoformat()
+        signups = await self._count_per_day(
+            "SELECT date(created_at), COUNT(*) FROM users WHERE created_at >= ? AND created_at < ? GROUP BY 1", lo, hi)
+        active = await self._count_per_day(
+            "SELECT day, COUNT(*) FROM user_activity WHERE day >= ? AND day < ? GROUP BY day", lo, hi)
+        created = await self._count_per_day(
+            "SELECT date(created_at), COUNT(*) FROM tasks WHERE created_at >= ? AND created_at < ? GROUP BY 1", lo, hi)
+        done = await self._count_per_day(
+            "SELECT date(completed_at), COUNT(*) FROM tasks WHERE completed_at >= ? AND completed_at < ? GROUP BY 1", lo, hi)
+        # Active on day D among users who signed up on D-7
+        retained = await self._count_per_day(
+            """
+            SELECT a.day, COUNT(*) FROM user_activity a JOIN users u ON u.id = a.user_id
+            WHERE a.day >= ? AND a.day < ? AND date(u.created_at) = date(a.day, '-7 days')
+            GROUP BY a.day
+            """, lo, hi)
+        events = {}
+        async with self.conn.execute(
+            "SELECT date(created_at), kind, COUNT(*) FROM stat_events WHERE created_at >= ? AND created_at < ? GROUP BY 1, 2",
+            (lo, hi)
+        ) as cursor:
+            for day, kind, count in await cursor.fetchall():
+                events[(day, kind)] = count
+        async with self.conn.execute(
+            "SELECT date(created_at), source, COUNT(*) FROM premium_grants WHERE created_at >= ? AND created_at < ? GROUP BY 1, 2",
+            (lo, hi)
+        ) as cursor:
+            for day, source, count in await cursor.fetchall():
+                events[(day, source)] = count
+
+        # Running totals start from everything before the range
+        async with self.conn.execute("SELECT COUNT(*) FROM users WHERE created_at < ?", (lo,)) as cursor:
+            users_total = (await cursor.fetchone())[0]
+        async with self.conn.execute("SELECT COUNT(*) FROM tasks WHERE created_at < ?", (lo,)) as cursor:
+            tasks_total = (await cursor.fetchone())[0]
+
+        rows = []
+        day = since
+        while day <= until:
+            key, next_day = day.isoformat(), (day + timedelta(days=1)).isoformat()
+            users_total += signups.get(key, 0)
+            tasks_total += created.get(key, 0)
+            # Premium running past the end of the day, as the ledger stood then: each
+            # user's last entry before next_day carries the resulting premium_until
+            # (NULL for a revoke), so later grants and revokes do not rewrite past days.
+            # Users with no ledger entries at all predate it and fall back to users.
+            async with self.conn.execute(
+                """
+                SELECT
+                    (SELECT COUNT(*) FROM (
+                        SELECT premium_until, MAX(id) FROM premium_grants WHERE created_at < ? GROUP BY user_id
+                    ) WHERE premium_until >= ?)
+                  + (SELECT COUNT(*) FROM users WHERE premium_until >= ?
+                        AND NOT EXISTS (SELECT 1 FROM premium_grants g WHERE g.user_id = users.id))
+                """,
+                (next_day, next_day, next_day)
+            ) as cursor:
+                premium_active = (await cursor.fetchone())[0]
+            rows.append((
+                key, signups.get(key, 0), active.get(key, 0), created.get(key, 0), done.get(key, 0),
+                events.get((key, "admin"), 0) + events.get((key, "payment"), 0), events.get((key, "trial"), 0),
+                events.get((key, "referral"), 0), events.get((key, "promo"), 0),
+                retained.get(key, 0), users_total, premium_active, tasks_total
+            ))
+            day += timedelta(days=1)
+
+        await self.conn.executemany(
+            """
+            INSERT OR REPLACE INTO stats_daily (
+                day, signups, active_users, tasks_created, tasks_done, premium_grants, trials,
+                referrals, promos_sent, retained_d7, users_total, premium_active, tasks_total
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows
+        )
+        await self.conn.commit()
+        return len(rows)
+
+    async def get_daily_stats(self, days: int = 14):
+        """Last N rolled-up days, oldest first."""
+        async with self.conn.execute("SELECT * FROM stats_daily ORDER BY day DESC LIMIT ?", (days,)) as cursor:
+            rows = await cursor.fetchall()
+        return rows[::-1]
+
+    async def get_trial_conversion(self, since: date):
+        """
+        Trial cohort started on or after `since`: how many users began a trial and
+        how many of them later got premium from an admin or a payment.
+        """
+        async with self.conn.execute(
+            """
+            SELECT COUNT(*) AS trials, COALESCE(SUM(EXISTS(
+                SELECT 1 FROM premium_grants p
+                WHERE p.user_id = t.user_id AND p.source IN ('admin', 'payment') AND p.id > t.id
+            )), 0) AS converted
+            FROM (
+                SELECT user_id, MIN(id) AS id FROM premium_grants
+                WHERE source = 'trial' AND created_at >= ? GROUP BY user_id
+            ) t
+            """,
+            (since.isoformat(),)
+        ) as cursor:
+            return await cursor.fetchone()
+
+    async def get_users_summary(self):
+        async with self.conn.execute(
+            f"SELECT COUNT(*) AS total, COALESCE(SUM({PREMIUM_ACTIVE_SQL}), 0) AS premium FROM users WHERE {LIVE_USER_SQL}"
+        ) as cursor:
+            return await cursor.fetchone()
+
+    async def get_expiring_premium_users(self, expired_within_days: int = 1, expires_within_days: int = 3):
+        """Users whose premium ended in the last N days or ends in the next M days (indexed range scan)."""
+        async with self.conn.execute(
+            f"SELECT {USER_COLUMNS} FROM users "
+            f"WHERE premium_until > datetime('now', ?) AND premium_until <= datetime('now', ?) AND {LIVE_USER_SQL}",
+            (f"-{expired_within_days} days", f"+{expires_within_days} days")
+        ) as cursor:
             return await cursor.fetchall()
 
     async def get_active_tasks_count(self, user_id: int):
@@ -250,21 +1182,51 @@ class Database:
 
     async def update_last_promo_sent(self, user_id: int):
         await self.conn.execute("UPDATE users SET last_promo_sent = CURRENT_TIMESTAMP WHERE id = ?", (user_id,))
+        await self._log_event("promo", user_id)
         await self.conn.commit()
 
     async def get_done_tasks(self, user_id: int):
-        async with self.conn.execute("SELECT * FROM tasks WHERE user_id = ? AND status = 'done' ORDER BY created_at DESC", (user_id,)) as cursor:
+        async with self.conn.execute(
+            "SELECT t.*, c.name AS category FROM tasks t LEFT JOIN categories c ON c.id = t.category_id "
+            "WHERE t.user_id = ? AND t.status = 'done' ORDER BY t.created_at DESC",
+            (user_id,)
+        ) as cursor:
             return await cursor.fetchall()
 
     async def delete_category(self, user_id: int, name: str):
+        # Built-in categories (user_id NULL) cannot be deleted this way
+        # Its tasks keep existing without a category (ON DELETE SET NULL)
         await self.conn.execute("DELETE FROM categories WHERE user_id = ? AND name = ?", (user_id, name))
         await self.conn.commit()
+        bus.publish(user_id, "category_deleted", {"name": name})
 
     async def rename_category(self, user_id: int, old_name: str, new_name: str):
-        # Update category name in categories table
+        # Tasks reference the category by id, so this is a single-row update
         await self.conn.execute("UPDATE categories SET name = ? WHERE user_id = ? AND name = ?", (new_name, user_id, old_name))
-        # Also update category name in tasks table for consistency
-        await self.conn.execute("UPDATE tasks SET category = ? WHERE user_id = ? AND category = ?", (new_name, user_id, old_name))
         await self.conn.commit()
+        bus.publish(user_id, "category_renamed", {"old_name": old_name, "new_name": new_name})
+
+
+def shard_paths(path: str, shards: int) -> list:
+    """bot.db, 3 -> [bot.db, bot.1.db, bot.2.db]: the existing file stays shard 0."""
+    if path == ":memory:":
+        return [path] * shards
+    root, ext = os.path.splitext(path)
+    return [path] + [f"{root}.{i}{ext}" for i in range(1, shards)]
+
+
+def create_storage(path: str = "bot.db", shards: int = 1) -> Storage:
+    """
+    Storage backend for `path`: a single Database, or a ShardedDatabase over
+    `shards` files. path=":memory:" gives an in-memory store (tests, benchmarks).
+    """
+    if shards <= 1:
+        return Database(path)
+    from database.sharded import ShardedDatabase
+    return ShardedDatabase(shard_paths(path, shards))
+
 
-db = Database()
+# DATABASE_PATH / DATABASE_SHARDS come from the environment (or .env), not from
+# config_reader, so scripts that only need storage do not require the bot settings
+load_dotenv()
+db = create_storage(os.getenv("DATABASE_PATH", "bot.db"), int(os.getenv("DATABASE_SHARDS", "1")))
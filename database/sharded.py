@@ -0,0 +1,463 @@
+import asyncio
+import heapq
+import logging
+from collections import defaultdict
+from datetime import date
+
+from database.database import Database
+from database.storage import Storage
+
+# Users are hashed into a fixed number of buckets (user_id % BUCKETS); the
+# bucket -> shard map lives in shard 0 (shard_buckets), so adding a shard
+# never silently re-homes anyone: buckets only change shard through move_bucket().
+BUCKETS = 1024
+# Task and reminder ids stay globally unique: shard k allocates from k << 40
+# upwards, and moved rows keep their ids (clients refer to them).
+SHARD_ID_SHIFT = 40
+ID_TABLES = ("tasks", "reminders")
+# SQLite's NOCASE folds A-Z only; merging shard streams sorted with it needs the same key
+NOCASE = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ", "abcdefghijklmnopqrstuvwxyz")
+
+DAILY_KEYS = (
+    "signups", "active_users", "tasks_created", "tasks_done", "premium_grants", "trials",
+    "referrals", "promos_sent", "retained_d7", "users_total", "premium_active", "tasks_total",
+)
+
+
+def _by_user(name):
+    """Method that runs on the shard owning the first argument (user_id)."""
+    async def method(self, user_id, *args, **kwargs):
+        return await self._call(user_id, name, user_id, *args, **kwargs)
+    method.__name__ = name
+    return method
+
+
+class ShardedDatabase(Storage):
+    """
+    Users spread over several SQLite files, each a full Database with its own
+    writer connection (and aiosqlite thread), so writes of different users
+    proceed in parallel. Everything that belongs to one user lives on one
+    shard; queries over all users fan out and merge. Shard 0 also holds the
+    bucket map and the FSM states.
+
+    Buckets are moved online with move_bucket(): calls for a user wait while
+    that user is being copied. The map is cached per process, so moves must run
+    in the process serving traffic (run_all.py, or /rebalance in the bot), or
+    with everything else stopped (rebalance_shards.py).
+    """
+
+    def __init__(self, paths: list, profile_cache_size: int = 10000, profile_ttl: float = 60):
+        self.shards = [Database(path, max(profile_cache_size // len(paths), 100), profile_ttl) for path in paths]
+        self._buckets = []
+        # bucket -> target shard of an unfinished move; bucket -> users still served by the source
+        self._moving_to = {}
+        self._pending = {}
+        # user_id / bucket -> event set when the copy or move setup is done; user_id -> calls in flight
+        self._locked = {}
+        self._frozen = {}
+        self._inflight = defaultdict(int)
+
+    @property
+    def conn(self):
+        return self.shards[0].conn
+
+    async def connect(self):
+        for shard in self.shards:
+            await shard.connect()
+        await self._load_buckets()
+
+    async def close(self):
+        for shard in self.shards:
+            await shard.close()
+        self._buckets = []
+
+    async def create_tables(self):
+        for index, shard in enumerate(self.shards):
+            await shard.create_tables()
+            if index:
+                floor = index << SHARD_ID_SHIFT
+                for table in ID_TABLES:
+                    await shard.conn.execute(
+                        "UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?", (floor, table, floor)
+                    )
+                    await shard.conn.execute(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                        (table, floor, table)
+                    )
+                await shard.conn.commit()
+        await self.shards[0].conn.execute("""
+            CREATE TABLE IF NOT EXISTS shard_buckets (
+                bucket INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                moving_to INTEGER
+            )
+        """)
+        await self.shards[0].conn.commit()
+        await self._load_buckets()
+
+    async def _load_buckets(self):
+        primary = self.shards[0].conn
+        async with primary.execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'shard_buckets'"
+        ) as cursor:
+            if not (await cursor.fetchone())[0]:
+                return  # create_tables() has not run yet
+        async with primary.execute("SELECT bucket, shard, moving_to FROM shard_buckets ORDER BY bucket") as cursor:
+            rows = await cursor.fetchall()
+
+        if not rows:
+            # First start: spread buckets evenly if there is no data yet;
+            # otherwise everything stays on shard 0 (an upgraded single-file
+            # install) until it is rebalanced.
+            populated = [shard for shard in self.shards if await self._count_users(shard)]
+            spread = not populated
+            rows = [(b, b % len(self.shards) if spread else 0, None) for b in range(BUCKETS)]
+            await primary.executemany("INSERT INTO shard_buckets (bucket, shard, moving_to) VALUES (?, ?, ?)", rows)
+            await primary.commit()
+
+        self._buckets = [row[1] for row in rows]
+        used = max(max(self._buckets), max((row[2] or 0) for row in rows))
+        if used >= len(self.shards):
+            raise RuntimeError(f"Buckets are mapped to shard {used}, but only {len(self.shards)} shards are configured")
+
+        self._moving_to = {row[0]: row[2] for row in rows if row[2] is not None}
+        self._pending = {}
+        for bucket, target in self._moving_to.items():
+            # Interrupted move: users already present on the target are served from there
+            source_users = await self._bucket_users(self.shards[self._buckets[bucket]], bucket)
+            target_users = await self._bucket_users(self.shards[target], bucket)
+            self._pending[bucket] = set(source_users) - set(target_users)
+
+    @staticmethod
+    async def _count_users(shard: Database) -> int:
+        async with shard.conn.execute("SELECT COUNT(*) FROM users") as cursor:
+            return (await cursor.fetchone())[0]
+
+    @staticmethod
+    async def _bucket_users(shard: Database, bucket: int) -> list:
+        async with shard.conn.execute("SELECT id FROM users WHERE id % ? = ?", (BUCKETS, bucket)) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    # Routing
+    def shard_index(self, user_id: int) -> int:
+        bucket = user_id % BUCKETS
+        target = self._moving_to.get(bucket)
+        if target is not None and user_id not in self._pending[bucket]:
+            return target
+        return self._buckets[bucket]
+
+    async def _call(self, user_id: int, name: str, *args, **kwargs):
+        while self._locked or self._frozen:
+            event = self._locked.get(user_id) or self._frozen.get(user_id % BUCKETS)
+            if event is None:
+                break
+            await event.wait()
+        shard = self.shards[self.shard_index(user_id)]
+        self._inflight[user_id] += 1
+        try:
+            return await getattr(shard, name)(*args, **kwargs)
+        finally:
+            self._inflight[user_id] -= 1
+            if not self._inflight[user_id]:
+                del self._inflight[user_id]
+
+    def forget_profile(self, user_id: int):
+        # Synchronous and cheap: no need to route it (or wait out a move)
+        for shard in self.shards:
+            shard.forget_profile(user_id)
+
+    async def _gather(self, name: str, *args, **kwargs) -> list:
+        return await asyncio.gather(*(getattr(shard, name)(*args, **kwargs) for shard in self.shards))
+
+    # Per-user methods
+    add_user = _by_user("add_user")
+    get_user = _by_user("get_user")
+    get_user_profile = _by_user("get_user_profile")
+    ensure_user = _by_user("ensure_user")
+    is_deleting = _by_user("is_deleting")
+    set_timezone = _by_user("set_timezone")
+    grant_premium = _by_user("grant_premium")
+    set_premium = _by_user("set_premium")
+    activate_trial = _by_user("activate_trial")
+    get_premium_grants = _by_user("get_premium_grants")
+    update_last_promo_sent = _by_user("update_last_promo_sent")
+    touch_activity = _by_user("touch_activity")
+    add_task = _by_user("add_task")
+    get_user_tasks = _by_user("get_user_tasks")
+    list_user_tasks = _by_user("list_user_tasks")
+    get_user_tasks_page = _by_user("get_user_tasks_page")
+    get_done_tasks = _by_user("get_done_tasks")
+    get_active_tasks_count = _by_user("get_active_tasks_count")
+    search_tasks = _by_user("search_tasks")
+    get_user_stats = _by_user("get_user_stats")
+    add_category = _by_user("add_category")
+    get_user_categories = _by_user("get_user_categories")
+    delete_category = _by_user("delete_category")
+    rename_category = _by_user("rename_category")
+    delete_all_user_data = _by_user("delete_all_user_data")
+    purge_account = _by_user("purge_account")
+
+    async def add_reminder(self, task_id: int, user_id: int, *args, **kwargs):
+        return await self._call(user_id, "add_reminder", task_id, user_id, *args, **kwargs)
+
+    async def mark_reminder_sent(self, reminder_id: int, user_id: int = None):
+        if user_id is None:
+            await self._gather("mark_reminder_sent", reminder_id)
+        else:
+            await self._call(user_id, "mark_reminder_sent", reminder_id, user_id)
+
+    async def mark_task_done(self, task_id: int, user_id: int = None):
+        if user_id is None:
+            await self._gather("mark_task_done", task_id)
+        else:
+            await self._call(user_id, "mark_task_done", task_id, user_id)
+
+    async def delete_task(self, task_id: int, user_id: int = None):
+        if user_id is None:
+            await self._gather("delete_task", task_id)
+        else:
+            await self._call(user_id, "delete_task", task_id, user_id)
+
+    async def add_referral(self, user_id: int, referrer_id: int):
+        if self.shard_index(user_id) == self.shard_index(referrer_id):
+            return await self._call(user_id, "add_referral", user_id, referrer_id)
+        # Two shards, two transactions: mark first, so a retry can never reward twice
+        marked = await self._call(user_id, "_set_referrer", user_id, referrer_id)
+        if marked:
+            await self._call(referrer_id, "grant_premium", referrer_id, 3, "referral")
+
+    # Queries over all users
+    async def get_active_reminders(self):
+        return [row for rows in await self._gather("get_active_reminders") for row in rows]
+
+    async def get_all_users(self):
+        return [row for rows in await self._gather("get_all_users") for row in rows]
+
+    async def get_expiring_premium_users(self, expired_within_days: int = 1, expires_within_days: int = 3):
+        results = await self._gather("get_expiring_premium_users", expired_within_days, expires_within_days)
+        return [row for rows in results for row in rows]
+
+    async def get_pending_deletions(self):
+        return [user_id for ids in await self._gather("get_pending_deletions") for user_id in ids]
+
+    async def get_users_page(self, offset: int, limit: int):
+        # Every shard's first offset+limit+1 rows are enough to cut the merged page
+        results = await self._gather("get_users_page", 0, offset + limit)
+        merged = heapq.merge(*results, key=lambda row: -row['id'])
+        return list(merged)[offset:offset + limit + 1]
+
+    async def find_users(self, query: str = "", status: str = None, limit: int = 20):
+        results = await self._gather("find_users", query, status, limit)
+        query = (query or "").strip().lstrip("@")
+        if query and not query.isdigit():
+            key = lambda row: (row['username'] or "").translate(NOCASE)
+        else:
+            key = lambda row: -row['id']
+        return list(heapq.merge(*results, key=key))[:limit]
+
+    async def get_users_summary(self):
+        results = await self._gather("get_users_summary")
+        return {"total": sum(row['total'] for row in results), "premium": sum(row['premium'] for row in results)}
+
+    async def get_trial_conversion(self, since: date):
+        # A user's ledger lives on their shard, so per-shard cohorts just add up
+        results = await self._gather("get_trial_conversion", since)
+        return {"trials": sum(row['trials'] for row in results), "converted": sum(row['converted'] for row in results)}
+
+    async def rebuild_search_index(self, batch_size: int = 5000) -> int:
+        return sum(await self._gather("rebuild_search_index", batch_size))
+
+    async def compact_reminders(self, retention_days: int = 30, batch_size: int = 500,
+                                pause: float = 0.05, vacuum_step: int = 1000) -> dict:
+        # One shard at a time: compaction is background work, not worth parallel I/O
+        totals = {"deleted": 0, "reclaimed_bytes": 0, "size_bytes": 0}
+        for shard in self.shards:
+            result = await shard.compact_reminders(retention_days, batch_size, pause, vacuum_step)
+            for key in totals:
+                totals[key] += result[key]
+        return totals
+
+    async def rollup_daily_stats(self, until: date = None, since: date = None) -> int:
+        return max(await self._gather("rollup_daily_stats", until, since))
+
+    async def get_daily_stats(self, days: int = 14):
+        """Per-shard stats_daily rows summed per day; every column is additive."""
+        by_day = {}
+        for rows in await self._gather("get_daily_stats", days):
+            for row in rows:
+                total = by_day.setdefault(row['day'], dict.fromkeys(DAILY_KEYS, 0))
+                for key in DAILY_KEYS:
+                    total[key] += row[key]
+        return [{"day": day, **by_day[day]} for day in sorted(by_day)[-days:]]
+
+    # Rebalancing
+    def bucket_counts(self) -> list:
+        counts = [0] * len(self.shards)
+        for shard in self._buckets:
+            counts[shard] += 1
+        return counts
+
+    def plan_rebalance(self) -> list:
+        """(bucket, target) moves that leave every shard with BUCKETS / N buckets (±1)."""
+        counts = self.bucket_counts()
+        quota = [BUCKETS // len(counts) + (i < BUCKETS % len(counts)) for i in range(len(counts))]
+        moves = []
+        for bucket, shard in enumerate(self._buckets):
+            if counts[shard] <= quota[shard]:
+                continue
+            target = min(range(len(counts)), key=lambda i: counts[i] - quota[i])
+            if counts[target] >= quota[target]:
+                break
+            moves.append((bucket, target))
+            counts[shard] -= 1
+            counts[target] += 1
+        return moves
+
+    async def move_bucket(self, bucket: int, target: int, batch_size: int = 500, pause: float = 0.05) -> int:
+        """
+        Move every user of a bucket to another shard while serving traffic.
+        Users are copied one at a time, each in a single target transaction;
+        routing switches to the target right after the copy commits (users
+        new to the bucket start there), then the source rows are deleted in
+        batches. Progress is recorded in shard_buckets, so an interrupted move
+        resumes where it stopped. Returns the number of users moved.
+        """
+        source = self._buckets[bucket]
+        if source == target:
+            return 0
+        if self._moving_to.get(bucket, target) != target:
+            raise RuntimeError(f"Bucket {bucket} is already moving to shard {self._moving_to[bucket]}")
+        source_db, target_db = self.shards[source], self.shards[target]
+        primary = self.shards[0].conn
+
+        if bucket not in self._moving_to:
+            # Hold the bucket's callers for a moment so the set of users left
+            # on the source is exact when routing starts to split
+            event = asyncio.Event()
+            self._frozen[bucket] = event
+            try:
+                while any(user_id % BUCKETS == bucket for user_id in self._inflight):
+                    await asyncio.sleep(0.01)
+                await primary.execute("UPDATE shard_buckets SET moving_to = ? WHERE bucket = ?", (target, bucket))
+                await primary.commit()
+                self._pending[bucket] = set(await self._bucket_users(source_db, bucket))
+                self._moving_to[bucket] = target
+            finally:
+                del self._frozen[bucket]
+                event.set()
+
+        moved = 0
+        for user_id in await self._bucket_users(source_db, bucket):
+            if user_id in self._pending[bucket]:
+                await self._move_user(bucket, user_id, source_db, target_db)
+            # Reads and writes already go to the target; the old copy can go
+            await source_db._remove_user_rows(user_id, batch_size, pause)
+            await source_db.conn.execute("DELETE FROM premium_grants WHERE user_id = ?", (user_id,))
+            await source_db.conn.commit()
+            moved += 1
+            await asyncio.sleep(pause)
+
+        await primary.execute("UPDATE shard_buckets SET shard = ?, moving_to = NULL WHERE bucket = ?", (target, bucket))
+        await primary.commit()
+        self._buckets[bucket] = target
+        del self._moving_to[bucket]
+        del self._pending[bucket]
+        return moved
+
+    async def _move_user(self, bucket: int, user_id: int, source: Database, target: Database):
+        event = asyncio.Event()
+        self._locked[user_id] = event
+        try:
+            # New calls now wait; let the ones already running on the source finish
+            while self._inflight.get(user_id):
+                await asyncio.sleep(0.01)
+            await self._copy_user(user_id, source, target)
+            self._pending[bucket].discard(user_id)
+        finally:
+            del self._locked[user_id]
+            event.set()
+
+    @staticmethod
+    async def _copy_user(user_id: int, source: Database, target: Database, batch_size: int = 1000):
+        """
+        Copy the user's rows to target in one transaction, keeping task and
+        reminder ids. The transaction runs on its own connection: the shared
+        one is committed by other code at any moment.
+        """
+        src = source.conn
+        # Leftovers of an earlier attempt that failed before routing switched
+        await target._remove_user_rows(user_id, batch_size, 0)
+        await target.conn.execute("DELETE FROM premium_grants WHERE user_id = ?", (user_id,))
+        await target.conn.commit()
+
+        async with src.execute("SELECT * FROM users WHERE id = ?", (user_id,)) as cursor:
+            user = await cursor.fetchone()
+        if user is None:
+            return
+
+        async with target.transaction() as dst:
+            async with dst.execute("SELECT name, seq FROM sqlite_sequence WHERE name IN (?, ?)", ID_TABLES) as cursor:
+                sequences = [tuple(row) for row in await cursor.fetchall()]
+            columns = user.keys()
+            await dst.execute(
+                f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", tuple(user)
+            )
+
+            # Category ids are per shard: built-ins map by name, the user's own get new ids
+            category_map = {}
+            async with dst.execute("SELECT name, id FROM categories WHERE user_id IS NULL") as cursor:
+                builtin = dict(await cursor.fetchall())
+            async with src.execute("SELECT id, name, user_id FROM categories WHERE user_id IS NULL OR user_id = ?",
+                                   (user_id,)) as cursor:
+                for category_id, name, owner in await cursor.fetchall():
+                    if owner is None:
+                        category_map[category_id] = builtin.get(name)
+                        continue
+                    async with dst.execute(
+                        "INSERT INTO categories (user_id, name) VALUES (?, ?) RETURNING id", (user_id, name)
+                    ) as insert:
+                        category_map[category_id] = (await insert.fetchone())[0]
+
+            for table, query in (
+                ("tasks", "SELECT * FROM tasks WHERE user_id = ?"),
+                ("reminders", "SELECT r.* FROM reminders r JOIN tasks t ON t.id = r.task_id WHERE t.user_id = ?"),
+                ("premium_grants", "SELECT * FROM premium_grants WHERE user_id = ?"),
+            ):
+                async with src.execute(query, (user_id,)) as cursor:
+                    while True:
+                        rows = await cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        columns = [c for c in rows[0].keys() if not (table == "premium_grants" and c == "id")]
+                        values = []
+                        for row in rows:
+                            row = dict(row)
+                            if table == "tasks":
+                                row['category_id'] = category_map.get(row['category_id'])
+                            values.append(tuple(row[c] for c in columns))
+                        await dst.executemany(
+                            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                            values
+                        )
+
+            # Explicit ids from another shard's range must not move this shard's counter
+            await dst.executemany("UPDATE sqlite_sequence SET seq = ? WHERE name = ?",
+                                  [(seq, name) for name, seq in sequences])
+        target.profiles.pop(user_id)
+        logging.debug(f"Copied user {user_id} to {target.db_path}")
+
+    async def rebalance(self, progress=None, pause: float = 0.05) -> int:
+        """
+        Run plan_rebalance(). progress("buckets", done, total) is awaited after
+        each bucket (same shape as utils.export progress). Returns users moved.
+        """
+        moves = self.plan_rebalance()
+        # Finish interrupted moves first
+        moves = [(b, t) for b, t in self._moving_to.items()] + [(b, t) for b, t in moves if b not in self._moving_to]
+        users = 0
+        for done, (bucket, target) in enumerate(moves, 1):
+            users += await self.move_bucket(bucket, target, pause=pause)
+            if progress:
+                await progress("buckets", done, len(moves))
+        return users
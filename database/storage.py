@@ -0,0 +1,162 @@
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+
+
+class Storage(ABC):
+    """
+    What handlers, the API and the scheduler may call on `db`.
+
+    Implementations: Database (one SQLite file, or ":memory:" for tests and
+    benchmarks) and ShardedDatabase (users spread over several Database
+    shards). Besides these methods every implementation exposes:
+      conn   - connection of the primary file, used by the FSM storage and health checks
+      shards - the underlying Database objects (just [self] when not sharded)
+    """
+
+    # Lifecycle
+    @abstractmethod
+    async def connect(self): ...
+
+    @abstractmethod
+    async def close(self): ...
+
+    @abstractmethod
+    async def create_tables(self): ...
+
+    @abstractmethod
+    async def rebuild_search_index(self, batch_size: int = 5000) -> int: ...
+
+    # Users and premium
+    @abstractmethod
+    async def add_user(self, user_id: int, username: str): ...
+
+    @abstractmethod
+    async def get_user(self, user_id: int): ...
+
+    @abstractmethod
+    async def get_user_profile(self, user_id: int): ...
+
+    @abstractmethod
+    def forget_profile(self, user_id: int): ...
+
+    @abstractmethod
+    async def ensure_user(self, user_id: int, username: str): ...
+
+    @abstractmethod
+    async def is_deleting(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def set_timezone(self, user_id: int, timezone: str): ...
+
+    @abstractmethod
+    async def grant_premium(self, user_id: int, days: int, source: str = "admin", granted_by: int = None): ...
+
+    @abstractmethod
+    async def set_premium(self, user_id: int, is_premium: bool, days: int = 31, granted_by: int = None): ...
+
+    @abstractmethod
+    async def activate_trial(self, user_id: int, days: int = 3): ...
+
+    @abstractmethod
+    async def add_referral(self, user_id: int, referrer_id: int): ...
+
+    @abstractmethod
+    async def get_premium_grants(self, user_id: int, limit: int = 10): ...
+
+    @abstractmethod
+    async def update_last_promo_sent(self, user_id: int): ...
+
+    @abstractmethod
+    async def touch_activity(self, user_id: int): ...
+
+    # Tasks, reminders and categories
+    @abstractmethod
+    async def add_task(self, user_id: int, text: str, category: str): ...
+
+    @abstractmethod
+    async def add_reminder(self, task_id: int, user_id: int, remind_at: datetime, type: str = "once",
+                           recurrence_rule: str = None): ...
+
+    @abstractmethod
+    async def mark_reminder_sent(self, reminder_id: int, user_id: int = None): ...
+
+    @abstractmethod
+    async def get_user_tasks(self, user_id: int): ...
+
+    @abstractmethod
+    async def list_user_tasks(self, user_id: int, category: str = None): ...
+
+    @abstractmethod
+    async def get_user_tasks_page(self, user_id: int, offset: int, limit: int): ...
+
+    @abstractmethod
+    async def get_done_tasks(self, user_id: int): ...
+
+    @abstractmethod
+    async def get_active_tasks_count(self, user_id: int): ...
+
+    @abstractmethod
+    async def mark_task_done(self, task_id: int, user_id: int = None): ...
+
+    @abstractmethod
+    async def delete_task(self, task_id: int, user_id: int = None): ...
+
+    @abstractmethod
+    async def search_tasks(self, user_id: int, query: str, limit: int = 20, offset: int = 0): ...
+
+    @abstractmethod
+    async def get_user_stats(self, user_id: int): ...
+
+    @abstractmethod
+    async def add_category(self, user_id: int, name: str): ...
+
+    @abstractmethod
+    async def get_user_categories(self, user_id: int): ...
+
+    @abstractmethod
+    async def delete_category(self, user_id: int, name: str): ...
+
+    @abstractmethod
+    async def rename_category(self, user_id: int, old_name: str, new_name: str): ...
+
+    # Account deletion
+    @abstractmethod
+    async def delete_all_user_data(self, user_id: int) -> bool: ...
+
+    @abstractmethod
+    async def get_pending_deletions(self): ...
+
+    @abstractmethod
+    async def purge_account(self, user_id: int, batch_size: int = 500, pause: float = 0.05) -> int: ...
+
+    # Queries over all users (admin panel, scheduler jobs)
+    @abstractmethod
+    async def get_active_reminders(self): ...
+
+    @abstractmethod
+    async def get_all_users(self): ...
+
+    @abstractmethod
+    async def get_users_page(self, offset: int, limit: int): ...
+
+    @abstractmethod
+    async def find_users(self, query: str = "", status: str = None, limit: int = 20): ...
+
+    @abstractmethod
+    async def get_trial_conversion(self, since: date): ...
+
+    @abstractmethod
+    async def get_users_summary(self): ...
+
+    @abstractmethod
+    async def get_expiring_premium_users(self, expired_within_days: int = 1, expires_within_days: int = 3): ...
+
+    @abstractmethod
+    async def compact_reminders(self, retention_days: int = 30, batch_size: int = 500,
+                                pause: float = 0.05, vacuum_step: int = 1000) -> dict: ...
+
+    @abstractmethod
+    async def rollup_daily_stats(self, until: date = None, since: date = None) -> int: ...
+
+    @abstractmethod
+    async def get_daily_stats(self, days: int = 14): ...
@@ -1,7 +1,23 @@
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.filters import Command, CommandObject
+from aiogram.types import (
+    Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
+    InlineQuery, InlineQueryResultArticle, InputTextMessageContent, FSInputFile,
+    BufferedInputFile,
+)
+from config_reader import config
 from database.database import db
+from utils.pagination import render_page, shorten
+from utils import backup, export, profiling
+from utils.metrics import JOB_STATS
+import asyncio
+import html
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+from datetime import date
 
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
@@ -19,7 +35,14 @@ async def cmd_godmode(message: Message, is_admin: bool):
     await message.answer("🔧 Режим Бога активирован.\n"
                          "Команды:\n"
                          "/grant_premium [ID] - Выдать премиум\n"
-                         "/users - Список пользователей и статистика")
+                         "/users - Список пользователей и статистика\n"
+                         "/find [ID | @username | начало ника] [premium|free|trial] - Поиск пользователя\n"
+                         "/export [parquet] - Выгрузка пользователей, задач и напоминаний\n"
+                         "/shards - Распределение пользователей по шардам БД\n"
+                         "/rebalance - Выровнять шарды (перенос пользователей без остановки)\n"
+                         "/backup - Снимок БД прямо сейчас (восстановление: restore_backup.py)\n"
+                         "/perf [mem|mem off] - Задержки event loop, задачи, память, медленные джобы\n"
+                         "/profile [секунд] - CPU-профиль (folded-стеки для speedscope)")
 
 @router.message(Command("grant_premium"))
 async def cmd_grant(message: Message, is_admin: bool):
@@ -33,78 +56,49 @@ async def cmd_grant(message: Message, is_admin: bool):
             return
         
         user_id = int(args[1])
-        await db.set_premium(user_id, True)
-        await message.answer(f"Админ-права (Premium) выданы пользователю {user_id}")
+        premium_until = await db.set_premium(user_id, True, granted_by=message.from_user.id)
+        if premium_until is None:
+            await message.answer(f"Пользователь {user_id} не найден")
+            return
+        await message.answer(f"Админ-права (Premium) выданы пользователю {user_id} до {premium_until:%d.%m.%Y}")
     except ValueError:
         await message.answer("ID должен быть числом")
 
+USERS_PAGE_SIZE = 30
+NOTES_PAGE_SIZE = 20
+
+def format_user_row(user, n):
+    username = user['username'] or "Без ника"
+    if user['is_premium']:
+        icon = "🎁" if user['trial_used'] else "🌟"
+    else:
+        icon = "👤"
+    days = f"{user['days']} д." if user['days'] is not None else "?"
+    return f"{icon} <code>{user['id']}</code> (@{html.escape(username)}) — {days}"
+
+async def render_users_page(offset: int):
+    summary = await db.get_users_summary()
+    return await render_page(
+        db.get_users_page,
+        format_user_row,
+        offset,
+        header="<b>👥 Список пользователей</b>\n",
+        footer=f"\nВсего: {summary['total']} | Premium: {summary['premium']}",
+        callback_prefix="users_page_",
+        page_size=USERS_PAGE_SIZE,
+        extra_rows=[[InlineKeyboardButton(text="⬅️ Админ панель", callback_data="admin_panel")]]
+    )
+
 @router.message(Command("users"))
 async def cmd_users_stats(message: Message, is_admin: bool):
     if not is_admin:
         return
-        
-    users = await db.get_all_users()
-    if not users:
+
+    text, markup, count = await render_users_page(0)
+    if not count:
         await message.answer("Пользователей нет.")
         return
-
-    from datetime import datetime
-    
-    total = len(users)
-    premium_count = 0
-    trial_count = 0
-    
-    text_lines = ["<b>👥 Список пользователей</b>\n"]
-    
-    now = datetime.now()
-    
-    for user in users:
-        uid = user['id']
-        username = user['username'] or "Без ника"
-        is_prem = bool(user['is_premium'])
-        created_at_str = user['created_at'] # string from db
-        
-        # Calculate time with us
-        try:
-            # Handle standard SQLite timestamp format
-            # Output of CURRENT_TIMESTAMP is usually 'YYYY-MM-DD HH:MM:SS'
-            created_dt = datetime.strptime(created_at_str, '%Y-%m-%d %H:%M:%S')
-            delta = now - created_dt
-            days = delta.days
-            
-            time_str = f"{days} д."
-        except Exception:
-            time_str = "?"
-            
-        if is_prem:
-            premium_count += 1
-            if user['trial_used']:
-                 trial_count += 1
-                 icon = "🎁"
-            else:
-                 icon = "🌟"
-        else:
-            icon = "👤"
-            
-        text_lines.append(f"{icon} <code>{uid}</code> (@{username}) — {time_str}")
-        
-    text_lines.append(f"\nВсего: {total} | Premium: {premium_count}")
-    
-    # Send in chunks if too long (Telegram limit 4096)
-    full_text = "\n".join(text_lines)
-    if len(full_text) > 4000:
-        # Simple chunking
-        chunk = ""
-        for line in text_lines:
-            if len(chunk) + len(line) > 4000:
-                await message.answer(chunk, parse_mode="HTML")
-                chunk = line + "\n"
-            else:
-                chunk += line + "\n"
-        if chunk:
-            await message.answer(chunk, parse_mode="HTML")
-    else:
-        await message.answer(full_text, parse_mode="HTML")
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
 
 @router.callback_query(F.data == "admin_panel")
 async def cb_admin_panel(callback: CallbackQuery, is_admin: bool):
@@ -130,66 +124,33 @@ async def cb_admin_panel(callback: CallbackQuery, is_admin: bool):
 async def cb_users_stats(callback: CallbackQuery, is_admin: bool):
     if not is_admin:
         return
-    
-    # Reuse logic from cmd_users_stats, but for callback edit? 
-    # Or just send new message? 
-    # If list is long, edit might fail if message type changes too much or multiple messages needed.
-    # Safe bet: Answer callback, then send message(s).
-    await callback.answer()
-    
-    users = await db.get_all_users()
-    if not users:
-        await callback.message.answer("Пользователей нет.")
+
+    text, markup, count = await render_users_page(0)
+    if not count:
+        await callback.answer("Пользователей нет.", show_alert=True)
         return
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
 
-    from datetime import datetime
-    total = len(users)
-    premium_count = 0
-    text_lines = ["<b>👥 Список пользователей</b>\n"]
-    now = datetime.now()
-    
-    for user in users:
-        uid = user['id']
-        username = user['username'] or "Без ника"
-        is_prem = bool(user['is_premium'])
-        created_at_str = user['created_at']
-        try:
-            created_dt = datetime.strptime(created_at_str, '%Y-%m-%d %H:%M:%S')
-            delta = now - created_dt
-            days = delta.days
-            time_str = f"{days} д."
-        except Exception:
-            time_str = "?"
-            
-        if is_prem:
-            premium_count += 1
-            icon = "🌟"
-        else:
-            icon = "👤"
-            
-        text_lines.append(f"{icon} <code>{uid}</code> (@{username}) — {time_str}")
-        
-    text_lines.append(f"\nВсего: {total} | Premium: {premium_count}")
-    
-    full_text = "\n".join(text_lines)
-    # Just send as new message to avoid edit limits if huge list
-    await callback.message.answer(full_text, parse_mode="HTML")
-    
-    # Show Admin Panel again?
-    await callback.message.answer("👑 Админ панель", reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="👥 Список пользователей", callback_data="admin_users_stats")],
-            [InlineKeyboardButton(text="➖ Забрать подписку", callback_data="admin_revoke_prem")],
-            [InlineKeyboardButton(text="⬅️ Назад в меню", callback_data="back_to_menu_from_admin")]
-    ]))
+@router.callback_query(F.data.startswith("users_page_"))
+async def cb_users_page(callback: CallbackQuery, is_admin: bool):
+    if not is_admin: return
+
+    offset = int(callback.data.split("_")[-1])
+    text, markup, _ = await render_users_page(offset)
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+
+@router.callback_query(F.data == "noop")
+async def cb_noop(callback: CallbackQuery):
+    # Page counter button between ◀ and ▶
+    await callback.answer()
 
 @router.callback_query(F.data == "admin_revoke_prem")
 async def cb_revoke_start(callback: CallbackQuery, state: FSMContext, is_admin: bool):
     if not is_admin: return
     
-    # Get all users to filter or get only premium? DB method get_all_users returns all. 
-    # Let's filter here.
-    users = await db.get_all_users()
-    premium_users = [u for u in users if u['is_premium']]
+    premium_users = await db.find_users(status="premium", limit=50)
     
     if not premium_users:
         await callback.message.edit_text(
@@ -201,8 +162,7 @@ async def cb_revoke_start(callback: CallbackQuery, state: FSMContext, is_admin:
         return
 
     keyboard = []
-    # Limit to 50 to avoid limits for now (simple cleanup)
-    for user in premium_users[:50]:
+    for user in premium_users:
         uid = user['id']
         name = user['username'] or f"User {uid}"
         # Button: "Username (ID)" -> revoke_12345
@@ -218,10 +178,12 @@ async def cb_revoke_start(callback: CallbackQuery, state: FSMContext, is_admin:
     )
 
 @router.callback_query(F.data.startswith("revoke_"))
-async def cb_revoke_confirm(callback: CallbackQuery):
+async def cb_revoke_confirm(callback: CallbackQuery, is_admin: bool):
+    if not is_admin: return
+
     user_id = int(callback.data.split("_")[1])
     
-    await db.set_premium(user_id, False)
+    await db.set_premium(user_id, False, granted_by=callback.from_user.id)
     await callback.answer(f"🚫 Подписка у {user_id} отключена.", show_alert=True)
     
     # Refresh list
@@ -231,10 +193,8 @@ async def cb_revoke_confirm(callback: CallbackQuery):
 async def cb_grant_start(callback: CallbackQuery, state: FSMContext, is_admin: bool):
     if not is_admin: return
     
-    users = await db.get_all_users()
-    # Filter non-premium users
-    # Sort by ID desc (newest first)
-    non_prem_users = sorted([u for u in users if not u['is_premium']], key=lambda x: x['id'], reverse=True)
+    # 30 newest users without premium; older ones are reachable via /find
+    non_prem_users = await db.find_users(status="free", limit=30)
     
     if not non_prem_users:
         await callback.message.edit_text(
@@ -246,8 +206,7 @@ async def cb_grant_start(callback: CallbackQuery, state: FSMContext, is_admin: b
         return
 
     keyboard = []
-    # Show top 30 newest users
-    for user in non_prem_users[:30]:
+    for user in non_prem_users:
         uid = user['id']
         name = user['username'] or f"User {uid}"
         keyboard.append([InlineKeyboardButton(text=f"✅ {name}", callback_data=f"grant_{uid}")])
@@ -262,10 +221,12 @@ async def cb_grant_start(callback: CallbackQuery, state: FSMContext, is_admin: b
     )
 
 @router.callback_query(F.data.startswith("grant_"))
-async def cb_grant_confirm(callback: CallbackQuery):
+async def cb_grant_confirm(callback: CallbackQuery, is_admin: bool):
+    if not is_admin: return
+
     user_id = int(callback.data.split("_")[1])
     
-    await db.set_premium(user_id, True)
+    await db.set_premium(user_id, True, granted_by=callback.from_user.id)
     await callback.answer(f"✅ Подписка выдана пользователю {user_id}.", show_alert=True)
     
     # Notify the user
@@ -319,7 +280,7 @@ async def cb_back_admin(callback: CallbackQuery):
 async def cb_inspect_users_list(callback: CallbackQuery, is_admin: bool):
     if not is_admin: return
     
-    users = await db.get_all_users()
+    users = await db.find_users(limit=30)
     if not users:
         await callback.message.edit_text("Пользователей нет.", 
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")]]))
@@ -327,8 +288,7 @@ async def cb_inspect_users_list(callback: CallbackQuery, is_admin: bool):
 
     keyboard = []
     # Show last 30 users for inspection
-    sorted_users = sorted(users, key=lambda x: x['id'], reverse=True)
-    for user in sorted_users[:30]:
+    for user in users:
         uid = user['id']
         name = user['username'] or f"User {uid}"
         keyboard.append([InlineKeyboardButton(text=f"👤 {name} ({uid})", callback_data=f"inspect_user_{uid}")])
@@ -337,11 +297,108 @@ async def cb_inspect_users_list(callback: CallbackQuery, is_admin: bool):
     
     await callback.message.edit_text(
         "<b>🔍 Выберите пользователя для инспекции:</b>\n"
-        "(Показаны последние 30)",
+        "(Показаны последние 30, остальных ищите через /find)",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
         parse_mode="HTML"
     )
 
+FIND_STATUSES = ("premium", "free", "trial")
+FIND_LIMIT = 20
+
+
+def parse_find_query(text: str):
+    """'ivan premium' -> ('ivan', 'premium'); the status word may stand anywhere."""
+    words = (text or "").split()
+    status = next((w.lower() for w in words if w.lower() in FIND_STATUSES), None)
+    query = " ".join(w for w in words if w.lower() not in FIND_STATUSES)
+    return query, status
+
+
+def user_label(user) -> str:
+    name = f"@{user['username']}" if user['username'] else f"User {user['id']}"
+    return f"{'🌟 ' if user['is_premium'] else ''}{name} ({user['id']})"
+
+
+@router.message(Command("find"))
+async def cmd_find(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        return
+
+    query, status = parse_find_query(command.args)
+    if not query and not status:
+        await message.answer(
+            "Использование: /find [ID | @username | начало ника] [premium|free|trial]\n"
+            "Например: /find ivan, /find 123456789, /find trial"
+        )
+        return
+
+    users = await db.find_users(query, status, limit=FIND_LIMIT)
+    if not users:
+        await message.answer("Никого не нашлось.")
+        return
+
+    keyboard = [
+        [InlineKeyboardButton(text=f"👤 {user_label(user)}", callback_data=f"inspect_user_{user['id']}")]
+        for user in users
+    ]
+    more = f" (первые {FIND_LIMIT}, уточните запрос)" if len(users) == FIND_LIMIT else ""
+    await message.answer(
+        f"<b>🔍 Найдено: {len(users)}</b>{more}",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard),
+        parse_mode="HTML"
+    )
+
+
+# AuthMiddleware is not attached to inline queries, so the admin check is done here.
+# Inline mode has to be enabled for the bot in @BotFather (/setinline).
+@router.inline_query()
+async def inline_find_users(inline_query: InlineQuery):
+    if inline_query.from_user.id not in config.admin_ids:
+        await inline_query.answer([], cache_time=300, is_personal=True)
+        return
+
+    query, status = parse_find_query(inline_query.query)
+    users = await db.find_users(query, status, limit=FIND_LIMIT)
+
+    results = []
+    for user in users:
+        username = f"@{html.escape(user['username'])}" if user['username'] else "—"
+        results.append(InlineQueryResultArticle(
+            id=str(user['id']),
+            title=user_label(user),
+            description=f"Premium до {user['premium_until']}" if user['is_premium'] else "Без подписки",
+            input_message_content=InputTextMessageContent(
+                message_text=(
+                    f"<b>👤 Пользователь</b>\n"
+                    f"<b>ID:</b> <code>{user['id']}</code>\n"
+                    f"<b>Username:</b> {username}\n"
+                    f"<b>Premium:</b> {'✅ Да' if user['is_premium'] else '❌ Нет'}\n"
+                    f"<b>Регистрация:</b> {user['created_at']}"
+                ),
+                parse_mode="HTML"
+            )
+        ))
+    await inline_query.answer(results, cache_time=0, is_personal=True)
+
+GRANT_SOURCES = {
+    "trial": "🎁 пробный",
+    "referral": "🤝 реферал",
+    "admin": "👑 админ",
+    "payment": "💳 оплата",
+    "revoke": "🚫 отключён",
+}
+
+
+def format_grant(grant) -> str:
+    source = GRANT_SOURCES.get(grant['source'], grant['source'])
+    line = f"• {grant['created_at'][:10]} {source}"
+    if grant['days']:
+        line += f" +{grant['days']} дн. → до {grant['premium_until'][:10]}"
+    if grant['granted_by']:
+        line += f" (<code>{grant['granted_by']}</code>)"
+    return line
+
+
 @router.callback_query(F.data.startswith("inspect_user_"))
 async def cb_inspect_user_details(callback: CallbackQuery, is_admin: bool):
     if not is_admin: return
@@ -354,18 +411,22 @@ async def cb_inspect_user_details(callback: CallbackQuery, is_admin: bool):
         return
         
     stats = await db.get_user_stats(user_id)
+    grants = await db.get_premium_grants(user_id, limit=10)
+    premium_text = f"✅ до {user['premium_until'][:16]}" if user['is_premium'] else "❌ Нет"
     
     text = (
         f"<b>👤 Инспекция пользователя</b>\n\n"
         f"<b>ID:</b> <code>{user_id}</code>\n"
         f"<b>Username:</b> @{user['username'] or '—'}\n"
-        f"<b>Premium:</b> {'✅ Да' if user['is_premium'] else '❌ Нет'}\n"
+        f"<b>Premium:</b> {premium_text}\n"
         f"<b>Регистрация:</b> {user['created_at']}\n\n"
         f"<b>📊 Статистика:</b>\n"
         f"• Всего задач: {stats['total']}\n"
         f"• Выполнено: {stats['done']}\n"
         f"• Активных: {stats['total'] - stats['done']}"
     )
+    if grants:
+        text += "\n\n<b>🌟 История Premium:</b>\n" + "\n".join(format_grant(g) for g in grants)
     
     keyboard = [
         [InlineKeyboardButton(text="📝 Посмотреть записи", callback_data=f"view_user_notes_{user_id}")],
@@ -374,89 +435,133 @@ async def cb_inspect_user_details(callback: CallbackQuery, is_admin: bool):
     
     await callback.message.edit_text(text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard), parse_mode="HTML")
 
+async def render_notes_page(user_id: int, offset: int):
+    return await render_page(
+        lambda offset, limit: db.get_user_tasks_page(user_id, offset, limit),
+        lambda task, n: f"{n}. {html.escape(shorten(task['text'] or ''))} (<i>{task['created']}</i>)",
+        offset,
+        header=f"<b>📝 Активные записи пользователя {user_id}:</b>\n",
+        callback_prefix=f"notes_page_{user_id}_",
+        page_size=NOTES_PAGE_SIZE,
+        extra_rows=[
+            [InlineKeyboardButton(text="👤 К профилю пользователя", callback_data=f"inspect_user_{user_id}")],
+            [InlineKeyboardButton(text="⬅️ К списку всех", callback_data="admin_inspect_users")]
+        ]
+    )
+
 @router.callback_query(F.data.startswith("view_user_notes_"))
 async def cb_view_user_notes(callback: CallbackQuery, is_admin: bool):
     if not is_admin: return
     
     user_id = int(callback.data.split("_")[-1])
-    tasks = await db.get_user_tasks(user_id)
-    
-    if not tasks:
+    text, markup, count = await render_notes_page(user_id, 0)
+    if not count:
         await callback.answer("У пользователя нет активных записей", show_alert=True)
         return
-        
-    await callback.answer()
-    
-    text_lines = [f"<b>📝 Активные записи пользователя {user_id}:</b>\n"]
-    for i, task in enumerate(tasks, 1):
-        created = task['created_at'].split()[0] if ' ' in task['created_at'] else task['created_at']
-        line = f"{i}. {task['text']} (<i>{created}</i>)"
-        text_lines.append(line)
-        
-    full_text = "\n".join(text_lines)
-    
-    # Check length
-    if len(full_text) > 4000:
-        chunks = []
-        current_chunk = ""
-        for i, line in enumerate(text_lines):
-            if len(current_chunk) + len(line) > 4000:
-                chunks.append(current_chunk)
-                current_chunk = line + "\n"
-            else:
-                current_chunk += line + "\n"
-        chunks.append(current_chunk)
-        
-        for chunk in chunks:
-            await callback.message.answer(chunk, parse_mode="HTML")
-    else:
-        await callback.message.answer(full_text, parse_mode="HTML")
 
-    await callback.message.answer(
-        "Вернуться к инспекции?",
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="👤 К профилю пользователя", callback_data=f"inspect_user_{user_id}")],
-            [InlineKeyboardButton(text="⬅️ К списку всех", callback_data="admin_inspect_users")]
-        ])
-    )
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
 
-@router.callback_query(F.data == "admin_general_stats")
-async def cb_admin_general_stats(callback: CallbackQuery, is_admin: bool):
+@router.callback_query(F.data.startswith("notes_page_"))
+async def cb_notes_page(callback: CallbackQuery, is_admin: bool):
     if not is_admin: return
-    
-    users = await db.get_all_users()
-    total_users = len(users)
-    premium_users = len([u for u in users if u['is_premium']])
-    trial_users = len([u for u in users if u['is_premium'] and u['trial_used']])
-    
-    # Try to get task stats for all
-    total_tasks = 0
-    done_tasks = 0
-    for u in users:
-        s = await db.get_user_stats(u['id'])
-        total_tasks += s['total']
-        done_tasks += s['done']
-    
-    # Text-based Chart for Premium vs Free
-    prem_percent = int((premium_users / total_users * 100)) if total_users > 0 else 0
+
+    _, _, user_id, offset = callback.data.split("_")
+    text, markup, _ = await render_notes_page(int(user_id), int(offset))
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+
+SPARK = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values) -> str:
+    top = max(values, default=0)
+    if not top:
+        return SPARK[0] * len(values)
+    return "".join(SPARK[round(v / top * (len(SPARK) - 1))] for v in values)
+
+
+def trend(current: int, previous: int) -> str:
+    if not previous:
+        return ""
+    change = round((current - previous) / previous * 100)
+    return f" ({'+' if change >= 0 else ''}{change}%)"
+
+
+def render_general_stats(rows, trial_cohort) -> str:
+    """
+    Admin dashboard from stats_daily rows (oldest first, up to 14 days) plus the
+    trial cohort of the same window (see Database.get_trial_conversion).
+    """
+    last = rows[-1]
+    week, prev = rows[-7:], rows[-14:-7]
+
+    def total(period, field):
+        return sum(r[field] for r in period)
+
+    prem_percent = int(last['premium_active'] / last['users_total'] * 100) if last['users_total'] else 0
     bar_len = 10
     filled = int(bar_len * prem_percent / 100)
     bar = "⭐" * filled + "⚪" * (bar_len - filled)
-    
-    text = (
-        f"<b>📊 Общая статистика бота</b>\n\n"
-        f"👥 <b>Пользователи:</b> {total_users}\n"
-        f"🌟 <b>Premium:</b> {premium_users}\n"
-        f"🎁 <b>Пробный период:</b> {trial_users}\n"
-        f"[{bar}] {prem_percent}%\n\n"
-        f"📝 <b>Всего задач в БД:</b> {total_tasks}\n"
-        f"✅ <b>Выполнено:</b> {done_tasks}\n"
-        f"⏳ <b>В процессе:</b> {total_tasks - done_tasks}\n"
+
+    # Users who started a trial in the window and later got admin or paid premium
+    trials, converted = trial_cohort['trials'], trial_cohort['converted']
+    conversion = f"{round(converted / trials * 100)}% ({converted} из {trials})" if trials else "—"
+    # D7 retention: active this week among users who signed up 7 days earlier
+    cohort = total(prev, 'signups')
+    retention = f"{round(total(week, 'retained_d7') / cohort * 100)}%" if cohort else "—"
+
+    table = "\n".join(
+        f"{r['day'][5:]} {r['signups']:>4} {r['active_users']:>5} {r['tasks_created']:>5} {r['tasks_done']:>5}"
+        for r in week
     )
-    
+    return (
+        f"<b>📊 Общая статистика бота</b>\n"
+        f"<i>данные на конец {last['day']} (UTC)</i>\n\n"
+        f"👥 <b>Пользователи:</b> {last['users_total']}\n"
+        f"🌟 <b>Premium:</b> {last['premium_active']}\n"
+        f"[{bar}] {prem_percent}%\n"
+        f"📝 <b>Задач в БД:</b> {last['tasks_total']}\n\n"
+        f"<b>📈 За 7 дней</b> (к предыдущим 7):\n"
+        f"• Новых пользователей: {total(week, 'signups')}{trend(total(week, 'signups'), total(prev, 'signups'))}\n"
+        f"• DAU в среднем: {total(week, 'active_users') // len(week)}"
+        f"{trend(total(week, 'active_users'), total(prev, 'active_users'))}\n"
+        f"• Задач создано: {total(week, 'tasks_created')}{trend(total(week, 'tasks_created'), total(prev, 'tasks_created'))}\n"
+        f"• Задач выполнено: {total(week, 'tasks_done')}{trend(total(week, 'tasks_done'), total(prev, 'tasks_done'))}\n"
+        f"• Пробных периодов: {total(week, 'trials')}, выдано Premium: {total(week, 'premium_grants')}\n"
+        f"• Рефералов: {total(week, 'referrals')}, промо-рассылок: {total(week, 'promos_sent')}\n\n"
+        f"🎯 <b>Триал → Premium</b> (когорта {len(rows)} дн.): {conversion}\n"
+        f"🔁 <b>Удержание D7:</b> {retention}\n\n"
+        f"<b>DAU</b> {sparkline([r['active_users'] for r in rows])}\n"
+        f"<pre>день  нов   DAU задач   ✅\n{table}</pre>"
+    )
+
+
+@router.callback_query(F.data.in_({"admin_general_stats", "admin_stats_rollup"}))
+async def cb_admin_general_stats(callback: CallbackQuery, is_admin: bool):
+    if not is_admin: return
+
+    if callback.data == "admin_stats_rollup":
+        days = await db.rollup_daily_stats()
+        if not days:
+            await callback.answer("Данные уже актуальны (сегодняшний день попадёт в статистику завтра).")
+            return
+        await callback.answer(f"Пересчитано дней: {days}")
+
+    rows = await db.get_daily_stats(14)
+    if rows:
+        trial_cohort = await db.get_trial_conversion(date.fromisoformat(rows[0]['day']))
+        text = render_general_stats(rows, trial_cohort)
+    else:
+        text = (
+            "<b>📊 Общая статистика бота</b>\n\n"
+            "Статистика ещё не собрана: она пересчитывается каждую ночь после 00:05 UTC."
+        )
+
     await callback.message.edit_text(
         text,
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🔄 Пересчитать", callback_data="admin_stats_rollup")],
             [InlineKeyboardButton(text="⬅️ Назад", callback_data="admin_panel")]
         ]),
         parse_mode="HTML"
@@ -472,3 +577,186 @@ async def cb_admin_run_marketing(callback: CallbackQuery, is_admin: bool):
     import asyncio
     asyncio.create_task(send_marketing_mail(callback.bot, force=True))
 
+# One export at a time: each holds a read snapshot and a temp directory
+export_lock = asyncio.Lock()
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        return
+
+    fmt = "parquet" if (command.args or "").strip().lower() == "parquet" else "csv"
+    if fmt == "parquet" and not export.has_parquet():
+        await message.answer("Для Parquet нужен pyarrow (pip install pyarrow). Без аргумента будет CSV.")
+        return
+    if export_lock.locked():
+        await message.answer("Экспорт уже выполняется, дождитесь его завершения.")
+        return
+
+    async with export_lock:
+        status = await message.answer("⏳ Готовлю выгрузку...")
+
+        async def report(table: str, done: int, total: int):
+            try:
+                await status.edit_text(f"⏳ Выгрузка <b>{table}</b>: {done} / {total}", parse_mode="HTML")
+            except Exception:
+                pass  # "message is not modified" and flood limits must not stop the export
+
+        with tempfile.TemporaryDirectory(prefix="notebot-export-") as tmp:
+            try:
+                paths = await export.export_dataset(db, tmp, fmt, progress=export.throttled(report))
+            except Exception as e:
+                logging.error(f"Export failed: {e}")
+                await status.edit_text(f"❌ Ошибка выгрузки: {html.escape(str(e))}", parse_mode="HTML")
+                return
+
+            for i, path in enumerate(paths, 1):
+                await status.edit_text(f"📤 Отправляю файлы: {i} / {len(paths)}")
+                await message.answer_document(FSInputFile(path), caption=os.path.basename(path))
+
+        await status.edit_text(f"✅ Выгрузка готова: {len(paths)} файл(ов), формат {fmt}.")
+
+
+rebalance_lock = asyncio.Lock()
+
+
+@router.message(Command("shards"))
+async def cmd_shards(message: Message, is_admin: bool):
+    if not is_admin:
+        return
+
+    lines = []
+    buckets = db.bucket_counts() if len(db.shards) > 1 else [None]
+    for i, (shard, count) in enumerate(zip(db.shards, buckets)):
+        summary = await shard.get_users_summary()
+        size = os.path.getsize(shard.db_path) // (1024 * 1024) if os.path.exists(shard.db_path) else 0
+        bucket_text = f", бакетов: {count}" if count is not None else ""
+        lines.append(f"<b>#{i}</b> <code>{html.escape(shard.db_path)}</code> — "
+                     f"пользователей: {summary['total']}{bucket_text}, {size} МБ")
+    await message.answer("<b>🗄 Шарды БД</b>\n" + "\n".join(lines), parse_mode="HTML")
+
+
+@router.message(Command("rebalance"))
+async def cmd_rebalance(message: Message, is_admin: bool):
+    if not is_admin:
+        return
+    if len(db.shards) < 2:
+        await message.answer("БД не шардирована (DATABASE_SHARDS=1), переносить нечего.")
+        return
+    if rebalance_lock.locked():
+        await message.answer("Перебалансировка уже выполняется.")
+        return
+
+    async with rebalance_lock:
+        status = await message.answer("⏳ Переношу пользователей между шардами...")
+
+        async def report(_: str, done: int, total: int):
+            try:
+                await status.edit_text(f"⏳ Перенесено бакетов: {done} / {total}")
+            except Exception:
+                pass
+
+        try:
+            moved = await db.rebalance(progress=export.throttled(report, interval=5.0))
+        except Exception as e:
+            logging.error(f"Rebalance failed: {e}")
+            await status.edit_text(f"❌ Ошибка перебалансировки: {html.escape(str(e))}", parse_mode="HTML")
+            return
+        await status.edit_text(f"✅ Готово: перенесено пользователей {moved}, бакеты по шардам: {db.bucket_counts()}")
+
+
+@router.message(Command("backup"))
+async def cmd_backup(message: Message, is_admin: bool):
+    if not is_admin:
+        return
+
+    status = await message.answer("⏳ Делаю снимок БД...")
+    lines = []
+    for shard in db.shards:
+        if shard.db_path == ":memory:":
+            continue
+        try:
+            path = await backup.backup_database(shard.db_path, config.backup_dir, keep=config.backup_keep)
+        except Exception as e:
+            logging.error(f"Backup of {shard.db_path} failed: {e}")
+            await status.edit_text(f"❌ Ошибка снимка {html.escape(shard.db_path)}: {html.escape(str(e))}", parse_mode="HTML")
+            return
+        kept = len(backup.list_backups(shard.db_path, config.backup_dir))
+        lines.append(f"<code>{html.escape(path)}</code> — {os.path.getsize(path) // 1024} КБ, хранится снимков: {kept}")
+    await status.edit_text("✅ Снимок готов, целостность проверена:\n" + "\n".join(lines), parse_mode="HTML")
+
+
+PROFILE_MAX_SECONDS = 60
+profile_lock = asyncio.Lock()
+
+
+def render_perf() -> str:
+    lag = profiling.watchdog.percentiles()
+    lag_text = (
+        f"p50 {lag['p50']:.1f} | p90 {lag['p90']:.1f} | p99 {lag['p99']:.1f} | max {lag['max']:.1f} мс"
+        if lag else "нет данных"
+    )
+    lines = [
+        "<b>⚙️ Производительность</b>\n",
+        f"⏱ <b>Лаг event loop</b> ({len(profiling.watchdog.lags)} замеров): {lag_text}",
+        f"🧊 Зависаний дольше {profiling.watchdog.threshold:g} с: {profiling.watchdog.stalls} (стеки в логе)",
+        f"🧵 asyncio-задач: {len(asyncio.all_tasks())}",
+    ]
+
+    jobs = sorted(JOB_STATS.items(), key=lambda item: item[1]["max"], reverse=True)[:5]
+    if jobs:
+        lines.append("\n<b>🐢 Самые медленные джобы</b> (max / avg / последний, с):")
+        for name, stats in jobs:
+            avg = stats["total"] / stats["runs"] if stats["runs"] else 0
+            lines.append(f"<code>{name}</code>: {stats['max']:.2f} / {avg:.2f} / {stats['last']:.2f} "
+                         f"({stats['runs']} запусков)")
+
+    top = profiling.memory_top()
+    if top is None:
+        lines.append("\n🧠 tracemalloc выключен: /perf mem включит учёт аллокаций")
+    else:
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"\n<b>🧠 Память</b> (tracemalloc): {current / 2**20:.1f} МБ, пик {peak / 2**20:.1f} МБ")
+        for location, kib, count in top:
+            lines.append(f"<code>{html.escape(location[-60:])}</code> {kib:.0f} КБ ({count})")
+    return "\n".join(lines)
+
+
+@router.message(Command("perf"))
+async def cmd_perf(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        return
+
+    arg = (command.args or "").strip().lower()
+    if arg == "mem" and not tracemalloc.is_tracing():
+        # Costs CPU on every allocation, so only on request
+        tracemalloc.start()
+        await message.answer("🧠 Учёт аллокаций включён. Повторите /perf через минуту; выключить: /perf mem off")
+        return
+    if arg == "mem off":
+        tracemalloc.stop()
+    await message.answer(render_perf(), parse_mode="HTML")
+
+
+@router.message(Command("profile"))
+async def cmd_profile(message: Message, command: CommandObject, is_admin: bool):
+    if not is_admin:
+        return
+
+    arg = (command.args or "").strip()
+    seconds = min(int(arg), PROFILE_MAX_SECONDS) if arg.isdigit() and int(arg) > 0 else 10
+    if profile_lock.locked():
+        await message.answer("Профилирование уже идёт.")
+        return
+
+    async with profile_lock:
+        status = await message.answer(f"⏳ Снимаю CPU-профиль {seconds} с...")
+        # The sampler runs in a worker thread and reads the loop thread's stack from there
+        folded = await asyncio.to_thread(profiling.sample_profile, seconds)
+        name = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded.txt"
+        await message.answer_document(
+            BufferedInputFile(folded.encode("utf-8"), filename=name),
+            caption=f"CPU-профиль за {seconds} с, стеков: {len(folded.splitlines())}. Открыть: speedscope.app"
+        )
+        await status.delete()
@@ -7,15 +7,14 @@ from config_reader import config
 router = Router()
 
 @router.message(Command("start"))
-async def cmd_start(message: Message, command: CommandObject, is_premium: bool):
+async def cmd_start(message: Message, command: CommandObject, is_premium: bool, user_profile: dict = None):
     # Handle Referral
-    if command.args:
+    if command and command.args:
         try:
             referrer_id = int(command.args)
             user_id = message.from_user.id
             if referrer_id != user_id:
-                user = await db.get_user(user_id)
-                if user and not user['referred_by']:
+                if user_profile and not user_profile['referred_by']:
                     await db.add_referral(user_id, referrer_id)
         except Exception:
             pass
@@ -58,3 +57,31 @@ async def cb_refresh_menu(callback: CallbackQuery, is_premium: bool):
         parse_mode="HTML"
     )
     await callback.answer()
+
+@router.message(Command("delete_account"))
+async def cmd_delete_account(message: Message):
+    await message.answer(
+        "⚠️ <b>Удалить аккаунт?</b>\n\n"
+        "Будут безвозвратно удалены все ваши записи, напоминания и категории. "
+        "Premium-подписка тоже будет потеряна.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="🗑 Да, удалить всё", callback_data="delete_account_confirm")],
+            [InlineKeyboardButton(text="⬅️ Отмена", callback_data="delete_account_cancel")]
+        ]),
+        parse_mode="HTML"
+    )
+
+@router.callback_query(F.data == "delete_account_confirm")
+async def cb_delete_account_confirm(callback: CallbackQuery):
+    # Only marks the account; the rows are removed by a background job, which
+    # messages the user when it is done
+    await db.delete_all_user_data(callback.from_user.id)
+    await callback.message.edit_text(
+        "⏳ Удаляем ваши данные. Мы пришлём сообщение, когда всё будет готово."
+    )
+    await callback.answer()
+
+@router.callback_query(F.data == "delete_account_cancel")
+async def cb_delete_account_cancel(callback: CallbackQuery):
+    await callback.message.edit_text("Удаление отменено.")
+    await callback.answer()
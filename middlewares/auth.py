@@ -1,8 +1,9 @@
 from aiogram import BaseMiddleware
 from aiogram.types import Message
 from typing import Callable, Dict, Any, Awaitable
-from database.database import db
+from database.database import db, is_premium_active
 from config_reader import config
+from utils import tracing
 
 class AuthMiddleware(BaseMiddleware):
     async def __call__(
@@ -15,13 +16,16 @@ class AuthMiddleware(BaseMiddleware):
         if not user:
             return await handler(event, data)
 
-        # 1. Register or update user
-        db_user = await db.get_user(user.id)
-        if not db_user:
-            await db.add_user(user.id, user.username or "Unknown")
-            is_premium_db = False
-        else:
-            is_premium_db = bool(db_user['is_premium'])
+        # 1. Register user if needed (cached profile - no DB round trip for known users)
+        with tracing.span("middleware.auth"):
+            profile = await db.ensure_user(user.id, user.username or "Unknown")
+            if profile.get('deleting'):
+                # Nothing may be created for the account until purge_account() has removed it
+                await event.answer("⏳ Ваш аккаунт удаляется. Через несколько минут можно будет начать заново.")
+                return
+            await db.touch_activity(user.id)
+        # Evaluated against the clock on every update, so expiry is exact
+        is_premium_db = is_premium_active(profile['premium_until'])
 
         # 2. Check Admin status
         is_admin = user.id in config.admin_ids
@@ -33,5 +37,6 @@ class AuthMiddleware(BaseMiddleware):
         # 4. Inject into data
         data['is_premium'] = is_premium
         data['is_admin'] = is_admin
+        data['user_profile'] = profile
         
         return await handler(event, data)
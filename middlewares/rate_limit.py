@@ -0,0 +1,147 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import orjson
+
+READ_METHODS = {"GET", "HEAD"}
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float):
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+
+class RateLimiter:
+    """
+    Token buckets per (client, route class) plus a global cap on concurrent writes.
+    Everything lives in process memory - this protects the single SQLite writer,
+    it is not meant to be shared between workers.
+    """
+
+    def __init__(
+        self,
+        read_rate: float = 10.0,
+        read_burst: int = 30,
+        write_rate: float = 2.0,
+        write_burst: int = 10,
+        max_concurrent_writes: int = 4,
+        write_wait: float = 2.0,
+        max_clients: int = 50000,
+        on_throttle: Optional[Callable[[str, str], None]] = None,
+    ):
+        self.limits = {
+            "read": (read_rate, read_burst),
+            "write": (write_rate, write_burst),
+        }
+        self.write_wait = write_wait
+        self.max_clients = max_clients
+        self.on_throttle = on_throttle
+        self._write_slots = asyncio.Semaphore(max_concurrent_writes)
+        self._buckets = OrderedDict()
+        # (route_class, reason) -> number of rejected requests
+        self.throttled = {}
+
+    def take(self, client: str, route_class: str) -> float:
+        """Consume one token. Returns 0 if allowed, otherwise seconds until a token is available."""
+        rate, burst = self.limits[route_class]
+        key = (client, route_class)
+        now = time.monotonic()
+
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(burst)
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+            bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0
+        return (1 - bucket.tokens) / rate
+
+    async def acquire_write(self) -> bool:
+        try:
+            await asyncio.wait_for(self._write_slots.acquire(), self.write_wait)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def release_write(self):
+        self._write_slots.release()
+
+    def count(self, route_class: str, reason: str):
+        key = (route_class, reason)
+        self.throttled[key] = self.throttled.get(key, 0) + 1
+        if self.on_throttle:
+            self.on_throttle(route_class, reason)
+
+    def stats(self) -> dict:
+        return {f"{route_class}_{reason}": n for (route_class, reason), n in self.throttled.items()}
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying RateLimiter to /api/ routes.
+    identify(scope) returns a validated user id (or None - then the client IP is used).
+    """
+
+    def __init__(self, app, identify: Callable[[dict], Optional[int]], limiter: RateLimiter, exempt: tuple = ()):
+        self.app = app
+        self.identify = identify
+        self.limiter = limiter
+        self.exempt = exempt
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith("/api/") or scope["path"] in self.exempt:
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        if method == "OPTIONS":
+            # CORS preflight
+            return await self.app(scope, receive, send)
+
+        route_class = "read" if method in READ_METHODS else "write"
+        user_id = self.identify(scope)
+        if user_id is not None:
+            client = f"user:{user_id}"
+        else:
+            client = f"ip:{scope['client'][0] if scope.get('client') else 'unknown'}"
+
+        retry_after = self.limiter.take(client, route_class)
+        if retry_after:
+            self.limiter.count(route_class, "rate")
+            return await self._reject(send, retry_after)
+
+        if route_class == "read":
+            return await self.app(scope, receive, send)
+
+        if not await self.limiter.acquire_write():
+            self.limiter.count(route_class, "concurrency")
+            return await self._reject(send, 1)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release_write()
+
+    async def _reject(self, send, retry_after: float):
+        body = orjson.dumps({"detail": "Too many requests"})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,42 @@
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from typing import Callable, Dict, Any, Awaitable
+from utils import tracing
+
+# aiogram side of utils.tracing: one trace per update, a span for the handler,
+# a span per Bot API call. Kept out of utils.tracing so the API process, which
+# traces HTTP requests only, does not have to import aiogram.
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """Outer middleware on dp.update: opens the trace for the whole update."""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
+        if not tracing.enabled():
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        with tracing.start_trace("update", update_id=event.update_id, type=event.event_type,
+                                 user_id=user.id if user else None):
+            return await handler(event, data)
+
+
+class HandlerSpanMiddleware(BaseMiddleware):
+    """Inner middleware registered last, so its span covers just the handler."""
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
+        target = data.get("handler")
+        name = getattr(getattr(target, "callback", None), "__name__", "handler")
+        with tracing.span(f"handler.{name}"):
+            return await handler(event, data)
+
+
+class BotRequestTracing(BaseRequestMiddleware):
+    """Session middleware: a span per Bot API call (sendMessage, answerCallbackQuery, ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        with tracing.span(f"bot.{method.__api_method__}"):
+            return await make_request(bot, method)
+
+
+def instrument_bot(bot):
+    bot.session.middleware(BotRequestTracing())
+    return bot
@@ -0,0 +1,23 @@
+import asyncio
+from database.database import db
+
+async def report(_, done, total):
+    print(f"  buckets moved: {done} / {total}")
+
+async def main():
+    try:
+        await db.create_tables()
+        if len(db.shards) < 2:
+            print("DATABASE_SHARDS is 1: nothing to rebalance.")
+            return
+        print(f"Buckets per shard before: {db.bucket_counts()}")
+        moved = await db.rebalance(progress=report)
+        print(f"✅ Moved {moved} users. Buckets per shard: {db.bucket_counts()}")
+    except Exception as e:
+        print(f"❌ Error: {e}")
+    finally:
+        await db.close()
+
+if __name__ == "__main__":
+    # Run with the bot and API stopped; while they run, use /rebalance instead
+    asyncio.run(main())
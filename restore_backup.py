@@ -0,0 +1,22 @@
+import os
+import sys
+from database.database import SCHEMA_VERSION
+from utils.backup import restore_backup
+
+def main():
+    # python restore_backup.py backups/bot-20250101-040000.db [bot.db]
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python restore_backup.py <snapshot> [database file, default DATABASE_PATH or bot.db]")
+        sys.exit(2)
+    snapshot = sys.argv[1]
+    db_path = sys.argv[2] if len(sys.argv) == 3 else os.getenv("DATABASE_PATH", "bot.db")
+    try:
+        kept = restore_backup(snapshot, db_path, SCHEMA_VERSION)
+    except Exception as e:
+        print(f"❌ Restore failed, {db_path} left untouched: {e}")
+        sys.exit(1)
+    print(f"✅ {db_path} restored from {snapshot}." + (f" Previous file kept as {kept}." if kept else ""))
+
+if __name__ == "__main__":
+    # Stop the bot and the API first: they keep the old file open
+    main()
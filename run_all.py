@@ -0,0 +1,120 @@
+"""
+Single-process runtime: aiogram dispatcher, FastAPI app (uvicorn) and the
+scheduler on one event loop, sharing one Database connection, the user
+profile cache and the SSE event bus.
+
+    python run_all.py
+
+bot.py and `uvicorn api:app` keep working as separate processes; the bot's
+events then reach /api/events through the database (utils.events.EventRelay).
+"""
+import asyncio
+import contextlib
+import logging
+import signal
+
+import uvicorn
+from aiogram import Bot
+
+import bot as bot_app
+from api import app
+from config_reader import config
+from database.database import db
+from middlewares.tracing import instrument_bot
+from utils import tracing
+
+
+class EmbeddedServer(uvicorn.Server):
+    """uvicorn server that leaves signal handling to us, so shutdown is coordinated in one place."""
+
+    def install_signal_handlers(self):
+        pass
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+
+def install_stop_handlers(stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows: no loop signal handlers, fall back to a plain handler
+            signal.signal(sig, lambda *_: loop.call_soon_threadsafe(stop.set))
+
+
+async def main():
+    bot_app.set_console_icon()
+
+    # 1. Storage first: every component below shares this connection
+    await db.create_tables()
+
+    tracing.configure(config.trace_export, config.trace_file, config.trace_otlp_url, config.trace_slow_ms)
+    bot = instrument_bot(Bot(token=config.bot_token.get_secret_value()))
+    dp = bot_app.create_dispatcher()
+    scheduler = bot_app.create_scheduler(bot)
+
+    queue = None
+    webhook_mode = config.bot_mode == "webhook" and config.webhook_base_url
+    if config.bot_mode == "webhook" and not webhook_mode:
+        logging.error("BOT_MODE=webhook but WEBHOOK_BASE_URL is not set - falling back to polling")
+    if webhook_mode:
+        from utils.webhook import KeyedUpdateQueue, create_webhook_router
+        secret = config.webhook_secret.get_secret_value() if config.webhook_secret else None
+        queue = KeyedUpdateQueue(dp, bot, shards=config.webhook_shards, max_pending=config.webhook_max_pending)
+        app.include_router(create_webhook_router(bot, queue, config.webhook_path, secret))
+
+    stop = asyncio.Event()
+    install_stop_handlers(stop)
+
+    # 2. HTTP API (also serves /metrics and, in webhook mode, the webhook)
+    server = EmbeddedServer(uvicorn.Config(app, host=config.api_host, port=config.api_port, log_level="info"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        if server_task.done():
+            await db.close()
+            raise RuntimeError("API server failed to start")
+        await asyncio.sleep(0.05)
+
+    # 3. Background jobs, then 4. updates
+    polling_task = None
+    stop_task = asyncio.create_task(stop.wait())
+    try:
+        scheduler.start()
+        if queue:
+            queue.start()
+            await bot.set_webhook(
+                config.webhook_base_url.rstrip("/") + config.webhook_path,
+                secret_token=secret,
+                allowed_updates=dp.resolve_used_update_types()
+            )
+        else:
+            await bot.delete_webhook()
+            polling_task = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+        logging.info(f"Bot, API (port {config.api_port}) and scheduler are running in one process...")
+
+        # Run until a signal arrives or one of the long-running parts dies
+        watched = [stop_task, server_task] + ([polling_task] if polling_task else [])
+        await asyncio.wait(watched, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Shutdown in reverse order: stop taking updates, finish in-flight work,
+        # stop jobs and HTTP, and only then close the shared connection.
+        logging.info("Shutting down...")
+        if polling_task and not polling_task.done():
+            with contextlib.suppress(RuntimeError):
+                await dp.stop_polling()
+            await asyncio.gather(polling_task, return_exceptions=True)
+        if queue:
+            await queue.stop()
+        await dp.storage.close()
+        await bot_app.stop_scheduler(scheduler)
+        server.should_exit = True
+        await asyncio.gather(server_task, return_exceptions=True)
+        stop_task.cancel()
+        await bot.session.close()
+        await db.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+import glob
+import logging
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+# Pages copied per backup step and the pause after each one. 256 pages of
+# 4 KiB is about 1 MiB per step: each step holds the source's read lock only
+# briefly, and the pause lets the bot's writer thread have the disk.
+STEP_PAGES = 256
+STEP_PAUSE = 0.005
+
+STAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def _base_name(db_path: str) -> str:
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def list_backups(db_path: str, backup_dir: str) -> list:
+    """Snapshots of db_path in backup_dir, oldest first."""
+    pattern = os.path.join(backup_dir, f"{glob.escape(_base_name(db_path))}-*.db")
+    prefix = len(_base_name(db_path)) + 1
+    # Stamps sort chronologically as text
+    return sorted(p for p in glob.glob(pattern) if os.path.basename(p)[prefix:-3].replace("-", "").isdigit())
+
+
+def check_snapshot(path: str) -> int:
+    """Run integrity_check on a snapshot; returns its schema version (PRAGMA user_version)."""
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")]
+        if problems != ["ok"]:
+            raise RuntimeError(f"Integrity check failed for {path}: {'; '.join(problems[:5])}")
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _copy(db_path: str, target: str, pages: int, pause: float) -> int:
+    source = sqlite3.connect(db_path, isolation_level=None)
+    dest = sqlite3.connect(target)
+    try:
+        # Pin a read snapshot (WAL): commits by the bot during the copy go to
+        # the WAL and do not restart the backup, and the result is consistent
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(dest, pages=pages, sleep=pause)
+        source.execute("COMMIT")
+        # The snapshot is a standalone file: no WAL next to it
+        dest.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dest.close()
+        source.close()
+    return check_snapshot(target)
+
+
+async def backup_database(db_path: str, backup_dir: str, keep: int = 7,
+                          pages: int = STEP_PAGES, pause: float = STEP_PAUSE) -> str:
+    """
+    Online backup of db_path into backup_dir/<name>-<UTC stamp>.db with
+    SQLite's backup API, in steps of `pages` pages with a pause between them.
+    The copy runs on its own connection in a worker thread, so neither the
+    event loop nor the bot's connection is held. The snapshot must pass
+    integrity_check before it counts; then only the newest `keep` are kept.
+    Returns the snapshot path.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    path = os.path.join(backup_dir, f"{_base_name(db_path)}-{datetime.utcnow().strftime(STAMP_FORMAT)}.db")
+    partial = path + ".part"
+    try:
+        await asyncio.to_thread(_copy, db_path, partial, pages, pause)
+    except Exception:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    os.replace(partial, path)
+
+    for old in list_backups(db_path, backup_dir)[:-keep] if keep > 0 else []:
+        os.remove(old)
+        logging.info(f"Backup rotated out: {old}")
+    return path
+
+
+def restore_backup(snapshot: str, db_path: str, schema_version: int) -> str:
+    """
+    Replace db_path with a snapshot. The bot and API must be stopped.
+    The snapshot has to pass integrity_check and carry exactly schema_version
+    (an older one is accepted too: migrations bring it up on the next start).
+    The current file is kept as <db_path>.before-restore-<stamp>; returns that
+    path (None if there was no file).
+    """
+    version = check_snapshot(snapshot)
+    if version > schema_version:
+        raise RuntimeError(f"Snapshot has schema version {version}, this code only knows {schema_version}")
+
+    staged = db_path + ".restoring"
+    shutil.copyfile(snapshot, staged)
+    with open(staged, "rb+") as f:
+        os.fsync(f.fileno())
+
+    kept = None
+    if os.path.exists(db_path):
+        kept = f"{db_path}.before-restore-{datetime.utcnow().strftime(STAMP_FORMAT)}"
+        # Checkpoint first so the kept copy is complete without its WAL
+        conn = sqlite3.connect(db_path)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+        os.replace(db_path, kept)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    os.replace(staged, db_path)
+    return kept
@@ -0,0 +1,270 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict, deque
+from typing import Optional
+
+# Event ids look like "<boot>-<seq>". The boot part changes on every restart,
+# so a client resuming with an id from a previous run gets a "resync" event
+# instead of silently missing everything that happened while we were down.
+BOOT_ID = format(int(time.time()), "x")
+# Relay-only entry: another process changed this user's profile row, so a
+# cached copy (Database.profiles) must be dropped. Never streamed to clients.
+PROFILE_CHANGED = "_profile_changed"
+
+
+class Subscription:
+    """One SSE connection. Holds a bounded buffer of pending events."""
+
+    def __init__(self, user_id: int, max_size: int):
+        self.user_id = user_id
+        self.max_size = max_size
+        self.buffer = deque()
+        self.overflowed = False
+        self._wakeup = asyncio.Event()
+
+    def push(self, event: tuple):
+        if len(self.buffer) >= self.max_size:
+            # Slow consumer: drop what we have and ask the client to refetch
+            self.buffer.clear()
+            self.overflowed = True
+        else:
+            self.buffer.append(event)
+        self._wakeup.set()
+
+    async def get(self, timeout: float) -> Optional[tuple]:
+        """Next event, or None if nothing arrived within timeout (time for a heartbeat)."""
+        if not self.buffer and not self.overflowed:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+
+        if self.overflowed:
+            self.overflowed = False
+            return (None, "resync", {"reason": "buffer_overflow"})
+        if self.buffer:
+            return self.buffer.popleft()
+        return None
+
+
+def _seq(event: tuple) -> int:
+    return int(event[0].split("-")[1])
+
+
+class _History:
+    """Recent events of one user plus the seq of the newest one evicted from them."""
+    __slots__ = ("events", "dropped")
+
+    def __init__(self, dropped: int):
+        self.events = deque()
+        self.dropped = dropped
+
+
+class EventBus:
+    """
+    In-process pub/sub for per-user change notifications.
+    Database writes and the reminder scheduler publish here, /api/events streams it out.
+    When the bot and the API run as separate processes, EventRelay carries
+    the bot's events over to the API's bus.
+    """
+
+    def __init__(self, history_size: int = 50, max_users: int = 10000, queue_size: int = 100):
+        self.history_size = history_size
+        self.max_users = max_users
+        self.queue_size = queue_size
+        self._seq = 0
+        # user_id -> _History, LRU-bounded by number of users
+        self._history = OrderedDict()
+        # Newest seq among the histories dropped whole by the LRU bound
+        self._forgotten = 0
+        self._subscribers = {}
+        # Set by EventRelay in the publishing process: events to hand over
+        self.outbox = None
+
+    def publish(self, user_id: int, event_type: str, payload: dict = None) -> str:
+        self._seq += 1
+        event_id = f"{BOOT_ID}-{self._seq}"
+        event = (event_id, event_type, payload or {})
+
+        history = self._history.get(user_id)
+        if history is None:
+            # This user's earlier history may have been among the dropped ones
+            history = _History(self._forgotten)
+            self._history[user_id] = history
+            if len(self._history) > self.max_users:
+                _, oldest = self._history.popitem(last=False)
+                if oldest.events:
+                    self._forgotten = max(self._forgotten, _seq(oldest.events[-1]))
+        else:
+            self._history.move_to_end(user_id)
+        history.events.append(event)
+        if len(history.events) > self.history_size:
+            history.dropped = _seq(history.events.popleft())
+
+        for sub in self._subscribers.get(user_id, ()):
+            sub.push(event)
+        if self.outbox is not None:
+            self.outbox.append((user_id, event_type, event[2]))
+        return event_id
+
+    def profile_changed(self, user_id: int):
+        """Hand a profile cache invalidation to the other process; call it after the commit."""
+        if self.outbox is not None:
+            self.outbox.append((user_id, PROFILE_CHANGED, {}))
+
+    def subscribe(self, user_id: int, last_event_id: str = None) -> Subscription:
+        sub = Subscription(user_id, self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(sub)
+
+        if last_event_id:
+            self._replay(sub, last_event_id)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        subs = self._subscribers.get(sub.user_id)
+        if subs:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.user_id]
+
+    def _replay(self, sub: Subscription, last_event_id: str):
+        boot, _, seq = last_event_id.partition("-")
+        try:
+            last_seq = int(seq)
+        except ValueError:
+            last_seq = -1
+
+        if boot != BOOT_ID or last_seq < 0:
+            sub.push((None, "resync", {"reason": "unknown_event_id"}))
+            return
+
+        history = self._history.get(sub.user_id)
+        # An event newer than what the client has seen was evicted - we cannot fill that gap
+        if last_seq < (history.dropped if history else self._forgotten):
+            sub.push((None, "resync", {"reason": "history_expired"}))
+            return
+        for event in history.events if history else ():
+            if _seq(event) > last_seq:
+                sub.push(event)
+
+    def subscriber_count(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+
+def format_sse(event: tuple) -> str:
+    event_id, event_type, payload = event
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event_type}")
+    lines.append(f"data: {json.dumps(payload, ensure_ascii=False, default=str)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class EventRelay:
+    """
+    Carries bus events from the bot process to a separate API process through
+    the shared database. The bot side (start_outbox) writes what its bus
+    publishes to relay_events in batches; the API side (start_inbox) polls the
+    table and publishes new rows on its own bus, where /api/events picks them
+    up. Rows older than `retention` seconds are pruned by the bot side.
+    The writer uses a connection of its own: a commit on the shared one would
+    also commit whatever another coroutine has left half-done there. The
+    reader never writes, so it polls on the connection it is given.
+    The same table carries profile invalidations (PROFILE_CHANGED), so the
+    API's profile cache drops a user as soon as the bot grants or revokes
+    premium instead of serving the old row until its TTL runs out. The other
+    way round is not relayed: a timezone set through the API reaches the bot's
+    cache when its entry expires (Database profile_ttl, 60 s by default).
+    Not needed under run_all.py, where the bot and the API share one bus and
+    one profile cache.
+    """
+
+    def __init__(self, bus: EventBus, interval: float = 0.25, retention: float = 600):
+        self.bus = bus
+        self.interval = interval
+        self.retention = retention
+        self._task = None
+        self._forget_profile = None
+
+    def start_outbox(self, database):
+        """database: the Database (shard 0) holding relay_events."""
+        if self._task is None:
+            self.bus.outbox = []
+            self._task = asyncio.create_task(self._write(database))
+
+    def start_inbox(self, conn, forget_profile=None):
+        """forget_profile(user_id) drops a cached profile on PROFILE_CHANGED."""
+        if self._task is None:
+            self._forget_profile = forget_profile
+            self._task = asyncio.create_task(self._read(conn))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _write(self, database):
+        conn = await database.open_connection()
+        try:
+            await self._write_batches(conn)
+        finally:
+            await conn.close()
+
+    async def _write_batches(self, conn):
+        pruned = time.monotonic()
+        while True:
+            await asyncio.sleep(self.interval)
+            batch, self.bus.outbox = self.bus.outbox, []
+            try:
+                if batch:
+                    await conn.executemany(
+                        "INSERT INTO relay_events (user_id, type, payload) VALUES (?, ?, ?)",
+                        [(user_id, kind, json.dumps(payload, ensure_ascii=False, default=str))
+                         for user_id, kind, payload in batch]
+                    )
+                if time.monotonic() - pruned > 60:
+                    pruned = time.monotonic()
+                    await conn.execute(
+                        "DELETE FROM relay_events WHERE created_at < datetime('now', ?)",
+                        (f"-{int(self.retention)} seconds",)
+                    )
+                await conn.commit()
+            except sqlite3.Error as e:
+                logging.warning(f"Event relay: {len(batch)} events not handed over: {e}")
+
+    async def _read(self, conn):
+        last_id = None
+        while True:
+            try:
+                if last_id is None:
+                    # Start at the tail: events from before this process started are not replayed
+                    async with conn.execute("SELECT COALESCE(MAX(id), 0) FROM relay_events") as cursor:
+                        last_id = (await cursor.fetchone())[0]
+                async with conn.execute(
+                    "SELECT id, user_id, type, payload FROM relay_events WHERE id > ? ORDER BY id LIMIT 1000",
+                    (last_id,)
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            except sqlite3.OperationalError as e:
+                # The bot has not created the table yet
+                logging.debug(f"Event relay: {e}")
+                rows = []
+            for row_id, user_id, kind, payload in rows:
+                last_id = row_id
+                if kind == PROFILE_CHANGED:
+                    if self._forget_profile:
+                        self._forget_profile(user_id)
+                    continue
+                self.bus.publish(user_id, kind, json.loads(payload))
+            if len(rows) < 1000:
+                await asyncio.sleep(self.interval)
+
+
+bus = EventBus()
+relay = EventRelay(bus)
@@ -0,0 +1,183 @@
+import asyncio
+import csv
+import gzip
+import importlib.util
+import os
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+import aiosqlite
+
+
+# Telegram refuses bot uploads over 50 MB; files are split into parts below this
+MAX_PART_BYTES = 45 * 1024 * 1024
+
+# name -> (query, [(column, type)]); types are used for the Parquet schema
+EXPORTS = {
+    "users": (
+        "SELECT id, username, timezone, premium_until, trial_used, referred_by, created_at, last_promo_sent "
+        "FROM users WHERE deleting_at IS NULL ORDER BY id",
+        [("id", "int"), ("username", "str"), ("timezone", "str"), ("premium_until", "str"),
+         ("trial_used", "int"), ("referred_by", "int"), ("created_at", "str"), ("last_promo_sent", "str")],
+    ),
+    "tasks": (
+        "SELECT t.id, t.user_id, t.text, c.name, t.status, t.created_at, t.completed_at "
+        "FROM tasks t LEFT JOIN categories c ON c.id = t.category_id "
+        "WHERE t.user_id IN (SELECT id FROM users WHERE deleting_at IS NULL) ORDER BY t.id",
+        [("id", "int"), ("user_id", "int"), ("text", "str"), ("category", "str"), ("status", "str"),
+         ("created_at", "str"), ("completed_at", "str")],
+    ),
+    "reminders": (
+        "SELECT id, task_id, user_id, remind_at, type, recurrence_rule, is_sent FROM reminders "
+        "WHERE user_id IN (SELECT id FROM users WHERE deleting_at IS NULL) ORDER BY id",
+        [("id", "int"), ("task_id", "int"), ("user_id", "int"), ("remind_at", "str"), ("type", "str"),
+         ("recurrence_rule", "str"), ("is_sent", "int")],
+    ),
+}
+
+# progress(table, rows_written, rows_total)
+Progress = Callable[[str, int, int], Awaitable[None]]
+
+
+class _CsvPart:
+    def __init__(self, path: str, columns: list):
+        self.path = path
+        self._raw = open(path, "wb")
+        self._file = gzip.open(self._raw, "wt", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows: list):
+        self._writer.writerows(rows)
+
+    def size(self) -> int:
+        return self._raw.tell()
+
+    def close(self):
+        self._file.close()
+        self._raw.close()
+
+
+def has_parquet() -> bool:
+    # pyarrow takes a good part of a second to import, so it is only loaded
+    # once a Parquet export actually runs
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class _ParquetPart:
+    TYPES = {"int": "int64", "str": "string"}
+
+    def __init__(self, path: str, columns: list):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.path = path
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(name, self.TYPES[kind]) for name, kind in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression="zstd")
+
+    def write(self, rows: list):
+        # One row group per batch keeps memory flat
+        arrays = []
+        for values, field in zip(zip(*rows), self._schema):
+            if field.type == self._pa.string():
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(self._pa.array(values, type=field.type))
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def size(self) -> int:
+        return os.path.getsize(self.path)
+
+    def close(self):
+        self._writer.close()
+
+
+async def _export_table(conns: list, name: str, out_dir: str, fmt: str, batch_size: int,
+                        progress: Optional[Progress]) -> List[str]:
+    query, columns = EXPORTS[name]
+    part_class, ext = (_ParquetPart, "parquet") if fmt == "parquet" else (_CsvPart, "csv.gz")
+
+    total = 0
+    for conn in conns:
+        async with conn.execute(f"SELECT COUNT(*) FROM ({query})") as cursor:
+            total += (await cursor.fetchone())[0]
+
+    paths = []
+    part = None
+    written = 0
+    try:
+        # Shards are written one after another into the same sequence of parts
+        for conn in conns:
+            async with conn.execute(query) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    if part is None:
+                        part = part_class(os.path.join(out_dir, f"{name}.{len(paths) + 1:03d}.{ext}"), columns)
+                        paths.append(part.path)
+                    # Compression is CPU work: keep it off the event loop
+                    await asyncio.to_thread(part.write, [tuple(row) for row in rows])
+                    written += len(rows)
+                    if part.size() >= MAX_PART_BYTES:
+                        await asyncio.to_thread(part.close)
+                        part = None
+                    if progress:
+                        await progress(name, written, total)
+    finally:
+        if part is not None:
+            await asyncio.to_thread(part.close)
+
+    if not paths:
+        # Still ship a header-only file so every table is accounted for
+        empty = part_class(os.path.join(out_dir, f"{name}.001.{ext}"), columns)
+        empty.close()
+        paths.append(empty.path)
+    return paths
+
+
+async def export_dataset(database, out_dir: str, fmt: str = "csv", batch_size: int = 5000,
+                         progress: Optional[Progress] = None) -> List[str]:
+    """
+    Stream users, tasks and reminders into files under out_dir and return their paths.
+    fmt is "csv" (gzip-compressed) or "parquet" (needs pyarrow). Rows are read
+    with fetchmany and written batch by batch, so memory use does not grow
+    with the dataset. A separate read-only connection per file inside one
+    transaction gives a consistent snapshot (WAL) without blocking the bot's
+    writer; with several shards each one is its own snapshot.
+    """
+    if fmt == "parquet" and not has_parquet():
+        raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+
+    conns, owned = [], []
+    try:
+        for shard in database.shards:
+            if shard.db_path == ":memory:":
+                conns.append(shard.conn)
+                continue
+            conn = await aiosqlite.connect(Path(shard.db_path).resolve().as_uri() + "?mode=ro", uri=True)
+            owned.append(conn)
+            await conn.execute("BEGIN")
+            conns.append(conn)
+        paths = []
+        for name in EXPORTS:
+            paths += await _export_table(conns, name, out_dir, fmt, batch_size, progress)
+        return paths
+    finally:
+        for conn in owned:
+            await conn.close()
+
+
+def throttled(progress: Progress, interval: float = 2.0) -> Progress:
+    """Wrap a progress callback so it fires at most every `interval` seconds (and on completion)."""
+    last = 0.0
+
+    async def wrapper(name: str, done: int, total: int):
+        nonlocal last
+        now = time.monotonic()
+        if done < total and now - last < interval:
+            return
+        last = now
+        await progress(name, done, total)
+    return wrapper
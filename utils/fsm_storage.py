@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class _Entry:
+    __slots__ = ("state", "data", "updated_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], updated_at: float):
+        self.state = state
+        self.data = data
+        self.updated_at = updated_at
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM storage kept in the bot's SQLite database (fsm_states table).
+
+    Reads go through a bounded LRU cache (users without state are cached too,
+    so an ordinary update costs no query once the user is warm). Writes update
+    the cache immediately and are flushed to SQLite in batches every
+    flush_interval seconds. States idle for longer than ttl are treated as
+    absent and purged from the table in the background. start() must be
+    called once the event loop runs; close() stops the background task.
+    Once started, the storage works on a connection of its own: committing
+    the shared one would also commit other callers' half-done changes.
+    """
+
+    def __init__(self, database, cache_size: int = 2000, ttl: float = 24 * 3600,
+                 flush_interval: float = 2.0, purge_interval: float = 3600):
+        self.db = database
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.purge_interval = purge_interval
+        self._cache = OrderedDict()
+        # key -> entry waiting to be written; survives cache eviction
+        self._dirty = {}
+        self._task = None
+        self._own_conn = None
+        # The first purge runs right after start(): states left idle across a restart go too
+        self._last_purge = 0.0
+
+    @property
+    def _conn(self):
+        return self._own_conn or self.db.conn
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny
+        ))
+
+    async def _get(self, key: StorageKey) -> _Entry:
+        skey = self._key(key)
+        entry = self._dirty.get(skey) or self._cache.get(skey)
+        if entry is None:
+            async with self._conn.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (skey,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                entry = _Entry(row['state'], json.loads(row['data']) if row['data'] else {}, row['updated_at'])
+            else:
+                entry = _Entry(None, {}, time.time())
+
+        if entry.updated_at < time.time() - self.ttl:
+            # Abandoned conversation: start over
+            entry = _Entry(None, {}, time.time())
+        self._remember(skey, entry)
+        return entry
+
+    def _remember(self, skey: str, entry: _Entry):
+        self._cache[skey] = entry
+        self._cache.move_to_end(skey)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def start(self):
+        """Start the flush/purge loop (needs a running event loop)."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._background())
+
+    def _touch(self, key: StorageKey, entry: _Entry):
+        entry.updated_at = time.time()
+        self._dirty[self._key(key)] = entry
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._get(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._touch(key, entry)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._get(key)).state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._get(key)
+        entry.data = dict(data)
+        self._touch(key, entry)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._get(key)).data)
+
+    async def flush(self):
+        """Write pending changes in one transaction; cleared states are deleted."""
+        if not self._dirty:
+            return
+        pending, self._dirty = self._dirty, {}
+        upserts = []
+        deletes = []
+        for skey, entry in pending.items():
+            if entry.state is None and not entry.data:
+                deletes.append((skey,))
+            else:
+                upserts.append((skey, entry.state, json.dumps(entry.data, ensure_ascii=False), entry.updated_at))
+        try:
+            if upserts:
+                await self._conn.executemany(
+                    "INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, updated_at = excluded.updated_at",
+                    upserts
+                )
+            if deletes:
+                await self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+            await self._conn.commit()
+        except BaseException:
+            # Keep the changes for the next attempt unless newer ones replaced
+            # them (also when close() cancels a flush waiting for the write lock)
+            for skey, entry in pending.items():
+                self._dirty.setdefault(skey, entry)
+            raise
+
+    async def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        for skey in [k for k, e in self._cache.items() if e.updated_at < cutoff]:
+            del self._cache[skey]
+        cursor = await self._conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+        await self._conn.commit()
+        return cursor.rowcount
+
+    async def _background(self):
+        primary = self.db.shards[0]
+        if primary.db_path != ":memory:":
+            self._own_conn = await primary.open_connection()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge >= self.purge_interval:
+                    self._last_purge = time.time()
+                    purged = await self.purge_expired()
+                    if purged:
+                        logging.info(f"FSM storage: purged {purged} idle states")
+            except Exception as e:
+                logging.error(f"FSM storage flush failed: {e}")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._conn:
+            await self.flush()
+        if self._own_conn:
+            await self._own_conn.close()
+            self._own_conn = None
@@ -0,0 +1,168 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from datetime import datetime, timezone
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+
+from utils import tracing
+
+# One registry shared by the API and the bot process (served on /metrics by
+# the API and on a local port by the bot).
+registry = CollectorRegistry()
+
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+HTTP_REQUESTS = Counter(
+    "notebot_http_requests_total", "API requests", ["method", "route", "status"], registry=registry
+)
+HTTP_LATENCY = Histogram(
+    "notebot_http_request_duration_seconds", "API request latency", ["method", "route"],
+    buckets=FAST_BUCKETS, registry=registry
+)
+DB_LATENCY = Histogram(
+    "notebot_db_statement_duration_seconds", "Database call latency", ["operation"],
+    buckets=FAST_BUCKETS, registry=registry
+)
+JOB_DURATION = Histogram(
+    "notebot_scheduler_job_duration_seconds", "Scheduler job run time", ["job"],
+    buckets=JOB_BUCKETS, registry=registry
+)
+JOB_LAG = Histogram(
+    "notebot_scheduler_job_lag_seconds", "Delay between scheduled and actual job start", ["job"],
+    buckets=FAST_BUCKETS + (5, 10, 30, 60), registry=registry
+)
+MESSAGES = Counter(
+    "notebot_messages_total", "Messages sent by background jobs", ["job", "result"], registry=registry
+)
+LOOP_LAG = Histogram(
+    "notebot_event_loop_lag_seconds", "Event loop scheduling lag", buckets=FAST_BUCKETS, registry=registry
+)
+THROTTLED = Counter(
+    "notebot_api_throttled_total", "Requests rejected by the rate limiter", ["route_class", "reason"],
+    registry=registry
+)
+
+# job name -> {"runs", "total", "max", "last"} in seconds, for the admin /perf view
+JOB_STATS = {}
+# asyncio tasks of scheduler jobs running right now, so shutdown can wait for them
+RUNNING_JOBS = set()
+
+
+def render_latest():
+    """(body, content_type) for a /metrics response."""
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def serve(port: int, addr: str = "127.0.0.1"):
+    """Expose the registry on a local port (used by the bot process)."""
+    start_http_server(port, addr=addr, registry=registry)
+    logging.info(f"Metrics available on http://{addr}:{port}/metrics")
+
+
+def instrument_db(cls):
+    """Class decorator: time every public coroutine method of a Database class."""
+    for name, fn in list(vars(cls).items()):
+        if name.startswith("_") or not inspect.iscoroutinefunction(fn):
+            continue
+        setattr(cls, name, _timed_db_call(name, fn))
+    return cls
+
+
+def _timed_db_call(name, fn):
+    histogram = DB_LATENCY.labels(name)
+    span_name = f"db.{name}"
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span(span_name):
+                return await fn(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start)
+    return wrapper
+
+
+def track_job(fn):
+    """Decorator for scheduler jobs: records run time under the function name."""
+    histogram = JOB_DURATION.labels(fn.__name__)
+    trace_name = f"job.{fn.__name__}"
+    stats = JOB_STATS.setdefault(fn.__name__, {"runs": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        task = asyncio.current_task()
+        RUNNING_JOBS.add(task)
+        try:
+            with tracing.start_trace(trace_name):
+                return await fn(*args, **kwargs)
+        finally:
+            RUNNING_JOBS.discard(task)
+            elapsed = time.perf_counter() - start
+            histogram.observe(elapsed)
+            stats["runs"] += 1
+            stats["total"] += elapsed
+            stats["max"] = max(stats["max"], elapsed)
+            stats["last"] = elapsed
+    return wrapper
+
+
+def record_message(job: str, ok: bool):
+    MESSAGES.labels(job, "sent" if ok else "failed").inc()
+
+
+def observe_scheduler(scheduler):
+    """Record start lag for every job an APScheduler instance submits."""
+    from apscheduler.events import EVENT_JOB_SUBMITTED
+
+    def on_submitted(event):
+        if not event.scheduled_run_times:
+            return
+        job = scheduler.get_job(event.job_id)
+        name = job.func.__name__ if job else event.job_id
+        lag = (datetime.now(timezone.utc) - event.scheduled_run_times[0]).total_seconds()
+        JOB_LAG.labels(name).observe(max(lag, 0))
+
+    scheduler.add_listener(on_submitted, EVENT_JOB_SUBMITTED)
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            # Use the template (/api/tasks/{task_id}) so ids do not explode label cardinality
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_LATENCY.labels(method, path).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, path, str(status)).inc()
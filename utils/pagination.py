@@ -0,0 +1,72 @@
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+# fetch_page(offset, limit) -> up to limit + 1 rows; the extra row only tells
+# us that a next page exists, so no COUNT(*) is needed to paginate.
+FetchPage = Callable[[int, int], Awaitable[list]]
+
+
+def shorten(value: str, length: int = 200) -> str:
+    """Trim raw (not yet HTML-escaped) text for a listing line."""
+    return value if len(value) <= length else value[:length - 1] + "…"
+
+
+def fit_text(header: str, lines: List[str], footer: str = "", limit: int = TELEGRAM_TEXT_LIMIT) -> Tuple[str, int]:
+    """
+    Join header/lines/footer, dropping trailing lines if needed to stay within
+    limit. Returns the text and how many lines made it in (never fewer than
+    one while there are any: a single line is kept even if it is too long).
+    """
+    lines = list(lines)
+    text = "\n".join([header, *lines, footer]).strip()
+    while len(text) > limit and len(lines) > 1:
+        lines.pop()
+        text = "\n".join([header, *lines, "…", footer]).strip()
+    return text, len(lines)
+
+
+def nav_row(callback_prefix: str, offset: int, next_offset: Optional[int], page_size: int) -> List[InlineKeyboardButton]:
+    row = []
+    if offset > 0:
+        row.append(InlineKeyboardButton(text="◀", callback_data=f"{callback_prefix}{max(offset - page_size, 0)}"))
+    # Pages cut short by the text limit shift later offsets off the grid; round up
+    row.append(InlineKeyboardButton(text=f"· {-(-offset // page_size) + 1} ·", callback_data="noop"))
+    if next_offset is not None:
+        row.append(InlineKeyboardButton(text="▶", callback_data=f"{callback_prefix}{next_offset}"))
+    return row
+
+
+async def render_page(
+    fetch_page: FetchPage,
+    format_row: Callable[[object, int], str],
+    offset: int,
+    header: str,
+    callback_prefix: str,
+    page_size: int = 25,
+    footer: str = "",
+    extra_rows: Optional[List[List[InlineKeyboardButton]]] = None,
+) -> Tuple[str, InlineKeyboardMarkup, int]:
+    """
+    Build the page of a listing that starts at row `offset`: (text, keyboard,
+    rows shown). Navigation buttons carry f"{callback_prefix}{offset}" of the
+    neighbouring pages so the handler can edit the same message in place.
+    When the text limit cuts the page short, the next page starts at the
+    first row that was cut, so no row is skipped.
+    """
+    offset = max(offset, 0)
+    rows = await fetch_page(offset, page_size)
+    more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    lines = [format_row(row, offset + i + 1) for i, row in enumerate(rows)]
+    text, shown = fit_text(header, lines, footer)
+    has_next = more or shown < len(rows)
+
+    keyboard = []
+    if offset > 0 or has_next:
+        keyboard.append(nav_row(callback_prefix, offset, offset + shown if has_next else None, page_size))
+    keyboard.extend(extra_rows or [])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard), shown
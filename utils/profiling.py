@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+from collections import Counter, deque
+from typing import Optional
+
+from utils.metrics import LOOP_LAG
+
+
+class LoopWatchdog:
+    """
+    Measures event loop lag continuously and catches stalls as they happen.
+
+    A heartbeat task wakes up every `interval` seconds; how late it wakes up
+    is the lag (kept for percentiles and exported as a metric). A separate
+    thread checks the heartbeat; when the loop has not beaten for longer than
+    `threshold`, the loop thread is stuck in synchronous code and its current
+    stack - the code that is blocking - is logged once per stall.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 1.0, window: int = 3000):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=window)
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+
+    def start(self, threshold: Optional[float] = None):
+        """Start on the running loop; a second call is a no-op."""
+        if self._task is not None:
+            return
+        if threshold:
+            self.threshold = threshold
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0)
+            self.lags.append(lag)
+            LOOP_LAG.observe(lag)
+            self._beat = time.monotonic()
+
+    def _watch(self):
+        reported = None
+        while self._task is not None:
+            time.sleep(self.threshold / 4)
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or reported == beat:
+                continue
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(stack unavailable)"
+            logging.warning(f"Event loop blocked for {stalled:.2f}s, loop thread is at:\n{stack}")
+
+    def percentiles(self) -> dict:
+        """p50/p90/p99/max of the recent lag samples, in milliseconds."""
+        lags = sorted(self.lags)
+        if not lags:
+            return {}
+        pick = lambda q: lags[min(int(len(lags) * q), len(lags) - 1)] * 1000
+        return {"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": lags[-1] * 1000}
+
+
+watchdog = LoopWatchdog()
+
+
+class StartupTimer:
+    """Wall time per startup phase: each mark() closes the phase begun at the previous one."""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.phases = []
+        self._last = started
+
+    def mark(self, name: str):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def __str__(self) -> str:
+        parts = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases)
+        return f"{parts}; total {self._last - self.started:.2f}s"
+
+
+def memory_top(limit: int = 8) -> Optional[list]:
+    """Top allocation sites by size as (location, KiB, count), or None while tracemalloc is off."""
+    if not tracemalloc.is_tracing():
+        return None
+    stats = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    )).statistics("lineno")
+    return [(f"{s.traceback[0].filename}:{s.traceback[0].lineno}", s.size / 1024, s.count) for s in stats[:limit]]
+
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_profile(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sampling CPU profile of every thread except the sampler itself for
+    `seconds`. Blocking: run it in a worker thread. Returns the stacks in
+    "folded" format (one "thread;outer;...;inner count" line per distinct
+    stack), which speedscope and flamegraph.pl open directly.
+    """
+    me = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            keys = []
+            while frame is not None:
+                keys.append(_frame_key(frame))
+                frame = frame.f_back
+            stacks[";".join([names.get(ident, str(ident))] + keys[::-1])] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
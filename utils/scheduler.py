@@ -1,10 +1,14 @@
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from database.database import db
+from database.database import db, parse_timestamp
+from utils.events import bus
+from utils.metrics import track_job, record_message
 from datetime import datetime, timezone
 import logging
 import asyncio
+import os
 
+@track_job
 async def check_reminders(bot: Bot):
     reminders = await db.get_active_reminders()
     if not reminders:
@@ -23,18 +27,22 @@ async def check_reminders(bot: Bot):
         # I'll add a helper to get task by id or just accept generic message for now
         # Actually better to fix the query in database.py to join, but to avoid rewriting again:
         
+        delivered = False
         try:
             task_text = row['text']
             recurrence = row['recurrence_rule']
             
             await bot.send_message(user_id, f"🔔 <b>Напоминание!</b>\n{task_text}", parse_mode="HTML")
-            await db.mark_reminder_sent(reminder_id)
+            delivered = True
+            record_message("check_reminders", True)
+            await db.mark_reminder_sent(reminder_id, user_id)
+            bus.publish(user_id, "reminder_fired", {"id": reminder_id, "task_id": task_id, "text": task_text})
             
             # Reschedule if recurring
             if recurrence:
                 from datetime import timedelta
                 next_remind = None
-                current_remind_at = datetime.strptime(row['remind_at'], '%Y-%m-%d %H:%M:%S.%f') if '.' in row['remind_at'] else datetime.strptime(row['remind_at'], '%Y-%m-%d %H:%M:%S')
+                current_remind_at = parse_timestamp(row['remind_at'])
                 # Actually sqlite timestamp format might vary, easiest is to use now or parsed. 
                 # Let's base next on NOW or PREVIOUS? Usually previous to keep schedule.
                 
@@ -53,35 +61,26 @@ async def check_reminders(bot: Bot):
                     await db.add_reminder(task_id, user_id, next_remind, recurrence_rule=recurrence)
                     
         except Exception as e:
+            if not delivered:
+                record_message("check_reminders", False)
             logging.error(f"Failed to send reminder {reminder_id}: {e}")
 
+@track_job
 async def check_subscriptions(bot: Bot):
-    # This runs periodically (e.g. daily)
+    # This runs periodically (daily) and only sends notifications: premium
+    # itself is evaluated from premium_until at read time, nothing to flip here.
+    # Only users inside the notification window are loaded (indexed range).
     try:
-        users = await db.get_all_users()
+        users = await db.get_expiring_premium_users(expired_within_days=1, expires_within_days=3)
         utc_now = datetime.utcnow()
         
         for user in users:
-            if not user['is_premium'] or not user['premium_until']:
-                continue
-                
             uid = user['id']
-            # Parse premium_until
-            # It might be string if from sqlite
-            prem_until_raw = user['premium_until']
-            if isinstance(prem_until_raw, str):
-                try:
-                    # SQLite timestamp format: YYYY-MM-DD HH:MM:SS or HH:MM:SS.SSSSSS
-                    # Usually created by python datetime.utcnow() str
-                    if "." in prem_until_raw:
-                        prem_until = datetime.strptime(prem_until_raw, '%Y-%m-%d %H:%M:%S.%f')
-                    else:
-                        prem_until = datetime.strptime(prem_until_raw, '%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    logging.error(f"Date parse error for user {uid}: {prem_until_raw}")
-                    continue
-            else:
-                 prem_until = prem_until_raw
+            try:
+                prem_until = parse_timestamp(user['premium_until'])
+            except ValueError:
+                logging.error(f"Date parse error for user {uid}: {user['premium_until']}")
+                continue
 
             # Calculate delta
             delta = prem_until - utc_now
@@ -105,8 +104,7 @@ async def check_subscriptions(bot: Bot):
             
             msg = None
             if 0 > delta.total_seconds():
-                # Expired
-                await db.set_premium(uid, False)
+                # Expired within the last day (the window the query selects)
                 if is_trial:
                     msg = "🚫 <b>Ваш пробный период истек.</b>\nФункции ограничены. Чтобы продолжить пользоваться всеми фишками: /start -> Настройки"
                 else:
@@ -125,12 +123,15 @@ async def check_subscriptions(bot: Bot):
             if msg:
                 try:
                     await bot.send_message(uid, msg, parse_mode="HTML")
+                    record_message("check_subscriptions", True)
                 except Exception as e:
+                    record_message("check_subscriptions", False)
                     logging.warning(f"Failed to notify user {uid} about sub: {e}")
 
     except Exception as e:
             logging.error(f"Subscription check mechanism failed: {e}")
 
+@track_job
 async def send_morning_digest(bot: Bot):
     """
     Sends a morning summary of active tasks to each user.
@@ -151,15 +152,22 @@ async def send_morning_digest(bot: Bot):
             # Simple list generation
             task_list = "\n".join([f"• {t['text']}" for t in tasks])
             
-            await bot.send_message(
-                uid, 
-                f"☀️ <b>Доброе утро! Твой план на сегодня:</b>\n\n{task_list}\n\n<i>Продуктивного дня!</i>", 
-                parse_mode="HTML"
-            )
+            try:
+                await bot.send_message(
+                    uid, 
+                    f"☀️ <b>Доброе утро! Твой план на сегодня:</b>\n\n{task_list}\n\n<i>Продуктивного дня!</i>", 
+                    parse_mode="HTML"
+                )
+                record_message("send_morning_digest", True)
+            except Exception as e:
+                # One blocked user should not stop the digest for everyone else
+                record_message("send_morning_digest", False)
+                logging.warning(f"Failed to send digest to {uid}: {e}")
                 
     except Exception as e:
         logging.error(f"Morning digest failed: {e}")
 
+@track_job
 async def send_marketing_mail(bot: Bot, force: bool = False):
     """
     Sends marketing promotions to non-premium users. 
@@ -186,10 +194,7 @@ async def send_marketing_mail(bot: Bot, force: bool = False):
             
             # Parse dates
             try:
-                # Handle potential millisecond format or standard format
-                fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in created_at_str else '%Y-%m-%d %H:%M:%S'
-                created_at = datetime.strptime(created_at_str, fmt)
-                created_at = created_at.replace(tzinfo=timezone.utc)
+                created_at = parse_timestamp(created_at_str).replace(tzinfo=timezone.utc)
             except Exception as e:
                 logging.warning(f"Failed to parse created_at for user {uid}: {e}")
                 continue
@@ -197,9 +202,7 @@ async def send_marketing_mail(bot: Bot, force: bool = False):
             last_promo = None
             if last_promo_str:
                 try:
-                    fmt = '%Y-%m-%d %H:%M:%S.%f' if '.' in last_promo_str else '%Y-%m-%d %H:%M:%S'
-                    last_promo = datetime.strptime(last_promo_str, fmt)
-                    last_promo = last_promo.replace(tzinfo=timezone.utc)
+                    last_promo = parse_timestamp(last_promo_str).replace(tzinfo=timezone.utc)
                 except:
                     pass
 
@@ -248,9 +251,11 @@ async def send_marketing_mail(bot: Bot, force: bool = False):
                         ]),
                         parse_mode="HTML"
                     )
+                    record_message("send_marketing_mail", True)
                     await db.update_last_promo_sent(uid)
                     sent_count += 1
                 except Exception as e:
+                    record_message("send_marketing_mail", False)
                     logging.error(f"Failed to send promo to {uid}: {e}")
         
         # Notify Admin - always if forced, otherwise only if sent > 0
@@ -263,3 +268,55 @@ async def send_marketing_mail(bot: Bot, force: bool = False):
     except Exception as e:
         import traceback
         logging.error(f"Marketing mail failed: {e}\n{traceback.format_exc()}")
+
+
+@track_job
+async def rollup_daily_stats():
+    """Nightly analytics rollup; also catches up on days missed while the bot was down."""
+    days = await db.rollup_daily_stats()
+    if days:
+        logging.info(f"Stats rollup: {days} day(s) aggregated into stats_daily")
+
+
+@track_job
+async def compact_database():
+    """Nightly cleanup of sent reminder history (see Database.compact_reminders)."""
+    from config_reader import config
+
+    result = await db.compact_reminders(retention_days=config.reminder_retention_days)
+    logging.info(
+        f"Compaction: deleted {result['deleted']} sent reminders, "
+        f"reclaimed {result['reclaimed_bytes'] / 1024:.0f} KiB, database is now {result['size_bytes'] / 1024 / 1024:.1f} MiB"
+    )
+
+
+@track_job
+async def backup_database():
+    """Nightly online snapshot of every database file (see utils.backup)."""
+    from config_reader import config
+    from utils import backup
+
+    for shard in db.shards:
+        if shard.db_path == ":memory:":
+            continue
+        path = await backup.backup_database(shard.db_path, config.backup_dir, keep=config.backup_keep)
+        logging.info(f"Backup written: {path} ({os.path.getsize(path) / 1024 / 1024:.1f} MiB)")
+
+
+@track_job
+async def purge_deleted_accounts(bot: Bot):
+    """Background removal of accounts scheduled via Database.delete_all_user_data; resumes after restarts."""
+    for user_id in await db.get_pending_deletions():
+        removed = await db.purge_account(user_id)
+        logging.info(f"Account {user_id} purged ({removed} tasks)")
+        try:
+            await bot.send_message(
+                user_id,
+                "🗑 <b>Ваш аккаунт удалён.</b>\n\n"
+                "Все записи, напоминания и категории стёрты. Чтобы начать заново, отправьте /start.",
+                parse_mode="HTML"
+            )
+            record_message("purge_deleted_accounts", True)
+        except Exception as e:
+            record_message("purge_deleted_accounts", False)
+            logging.warning(f"Failed to notify {user_id} about account deletion: {e}")
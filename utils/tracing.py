@@ -0,0 +1,229 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+# Traces waiting for the exporter thread; when it falls behind, new ones are dropped
+QUEUE_SIZE = 1000
+# Paths whose requests are not traced: scrapes and long-lived streams
+UNTRACED_PATHS = ("/metrics", "/api/health", "/api/events")
+
+_current: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+_exporter = None
+
+
+class _Trace:
+    __slots__ = ("trace_id", "spans", "closed")
+
+    def __init__(self):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.spans = []
+        self.closed = False
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "attrs", "start_ns", "duration", "error", "_t0")
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str], attrs: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = time.time_ns()
+        self.duration = 0.0
+        self.error = None
+        self._t0 = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def _finish(self, error: Optional[BaseException]):
+        self.duration = time.perf_counter() - self._t0
+        if error is not None and not isinstance(error, GeneratorExit):
+            self.error = f"{type(error).__name__}: {error}"
+        self.trace.spans.append(self)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Child span of the current one; a no-op outside a trace, so it costs next to nothing there."""
+    parent = _current.get()
+    if parent is None or parent.trace.closed:
+        yield None
+        return
+    current = Span(parent.trace, name, parent.span_id, attrs)
+    token = _current.set(current)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        if not current.trace.closed:
+            current._finish(error)
+
+
+@contextmanager
+def start_trace(name: str, **attrs):
+    """Root span of a new trace (an update, an API request, a job run); exported when it ends."""
+    if _exporter is None:
+        yield None
+        return
+    root = Span(_Trace(), name, None, attrs)
+    token = _current.set(root)
+    error = None
+    try:
+        yield root
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        _current.reset(token)
+        root._finish(error)
+        # Tasks spawned inside the trace may outlive it; their spans are not recorded
+        root.trace.closed = True
+        _exporter.submit(root)
+
+
+def _span_dict(s: Span) -> dict:
+    return {
+        "trace_id": s.trace.trace_id, "span_id": s.span_id, "parent_id": s.parent_id, "name": s.name,
+        "start_ns": s.start_ns, "duration_ms": round(s.duration * 1000, 3), "error": s.error, "attrs": s.attrs,
+    }
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(s: Span) -> dict:
+    end_ns = s.start_ns + int(s.duration * 1e9)
+    out = {
+        "traceId": s.trace.trace_id, "spanId": s.span_id, "name": s.name, "kind": 1,
+        "startTimeUnixNano": str(s.start_ns), "endTimeUnixNano": str(end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in s.attrs.items() if v is not None],
+        "status": {"code": 2, "message": s.error} if s.error else {},
+    }
+    if s.parent_id:
+        out["parentSpanId"] = s.parent_id
+    return out
+
+
+class _Exporter:
+    """
+    Tail sampling plus export on a background thread. A finished trace is
+    kept if its root took at least slow_ms or any span failed; kept traces
+    go to a JSONL file (one span per line) or to an OTLP/HTTP JSON endpoint.
+    """
+
+    def __init__(self, mode: str, path: str, url: str, slow_ms: float, service: str):
+        self.mode = mode
+        self.path = path
+        self.url = url
+        self.slow = slow_ms / 1000
+        self.service = service
+        self.dropped = 0
+        self._queue = queue.Queue(QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, root: Span):
+        if root.duration < self.slow and not any(s.error for s in root.trace.spans):
+            return
+        try:
+            self._queue.put_nowait(root.trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self, timeout: float = 5):
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Whatever else is already waiting goes out in the same write/request
+            while batch[-1] is not None and not self._queue.empty() and len(batch) < 100:
+                batch.append(self._queue.get_nowait())
+            traces = [t for t in batch if t is not None]
+            if traces:
+                try:
+                    self._export(traces)
+                except Exception as e:
+                    logging.warning(f"Trace export failed ({len(traces)} traces): {e}")
+            if batch[-1] is None:
+                return
+
+    def _export(self, traces: list):
+        spans = [s for t in traces for s in t.spans]
+        if self.mode == "otlp":
+            body = {"resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service}}]},
+                "scopeSpans": [{"scope": {"name": "notebot"}, "spans": [_otlp_span(s) for s in spans]}],
+            }]}
+            request = urllib.request.Request(
+                self.url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+        else:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.writelines(json.dumps(_span_dict(s), ensure_ascii=False, default=str) + "\n" for s in spans)
+
+
+def enabled() -> bool:
+    return _exporter is not None
+
+
+def configure(mode: str, path: str = "traces.jsonl", url: str = "http://127.0.0.1:4318/v1/traces",
+              slow_ms: float = 0, service: str = "notebot"):
+    """
+    Turn tracing on. mode: "file" (JSONL at path), "otlp" (POST to url) or
+    "" to leave it off. slow_ms > 0 keeps only traces at least that slow
+    (failed ones are always kept). Calling it again is a no-op.
+    """
+    global _exporter
+    if not mode or _exporter is not None:
+        return
+    _exporter = _Exporter(mode, path, url, slow_ms, service)
+    atexit.register(_exporter.stop)
+    logging.info(f"Tracing enabled: {mode}, keeping traces >= {slow_ms} ms")
+
+
+class TracingMiddleware:
+    """ASGI middleware: one trace per HTTP request, named after the route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if _exporter is None or scope["type"] != "http" or scope["path"] in UNTRACED_PATHS:
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and root is not None:
+                root.set(status=message["status"])
+            await send(message)
+
+        with start_trace(f"http {scope['method']}", path=scope["path"]) as root:
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route:
+                    root.name = f"http {scope['method']} {route}"
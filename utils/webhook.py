@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from fastapi import APIRouter, Header, HTTPException, Request, Response
+
+
+def update_key(update: Update) -> int:
+    """Ordering key of an update: the chat it belongs to, else the user, else the update itself."""
+    event = update.event
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        message = getattr(event, "message", None)  # CallbackQuery.message
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return update.update_id
+
+
+class KeyedUpdateQueue:
+    """
+    Processes webhook updates concurrently while keeping per-chat order.
+
+    Updates are sharded by chat id onto a fixed number of worker queues; each
+    worker handles its queue sequentially, so one chat never sees reordering
+    but a slow handler only delays chats that hash onto the same shard.
+    Queues are bounded: when a shard is full submit() returns False and the
+    webhook answers 503, which makes Telegram back off and redeliver later.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, shards: int = 16, max_pending: int = 1000):
+        self.dp = dp
+        self.bot = bot
+        self.shards = shards
+        self.queues = [asyncio.Queue(maxsize=max(1, max_pending // shards)) for _ in range(shards)]
+        self._workers = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker(q)) for q in self.queues]
+
+    def submit(self, update: Update) -> bool:
+        queue = self.queues[update_key(update) % self.shards]
+        try:
+            queue.put_nowait(update)
+            return True
+        except asyncio.QueueFull:
+            logging.warning(f"Webhook backpressure: shard full, rejecting update {update.update_id}")
+            return False
+
+    def pending(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    async def stop(self, timeout: float = 10):
+        """Let accepted updates finish (up to timeout), then stop the workers."""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self.queues)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Webhook shutdown: dropping {self.pending()} unprocessed updates")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error(f"Failed to handle update {update.update_id}: {e}")
+            finally:
+                queue.task_done()
+
+
+def create_webhook_router(bot: Bot, queue: KeyedUpdateQueue, path: str, secret: Optional[str] = None) -> APIRouter:
+    """FastAPI router receiving Telegram webhook calls. Can be mounted into api.app or a standalone app."""
+    router = APIRouter()
+
+    @router.post(path, include_in_schema=False)
+    async def telegram_webhook(request: Request, x_telegram_bot_api_secret_token: Optional[str] = Header(None)):
+        if secret and x_telegram_bot_api_secret_token != secret:
+            raise HTTPException(status_code=403, detail="Bad secret token")
+
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+        if not queue.submit(update):
+            return Response(status_code=503, headers={"Retry-After": "1"})
+        return Response(status_code=200)
+
+    return router
@@ -0,0 +1,41 @@
+import os
+import sqlite3
+import sys
+import time
+from dotenv import load_dotenv
+from database.database import shard_paths
+
+def convert(path: str) -> bool:
+    """Switch one file to auto_vacuum=INCREMENTAL; rewrites the whole file (VACUUM)."""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print(f"{path}: already INCREMENTAL")
+            return False
+        start = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"{path}: switched to INCREMENTAL in {time.perf_counter() - start:.1f}s, "
+              f"{os.path.getsize(path) // 1024} KB")
+        return True
+    finally:
+        conn.close()
+
+def main():
+    # python vacuum_database.py [database file ...]  (default: DATABASE_PATH / DATABASE_SHARDS)
+    load_dotenv()
+    paths = sys.argv[1:] or shard_paths(os.getenv("DATABASE_PATH", "bot.db"), int(os.getenv("DATABASE_SHARDS", "1")))
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"{path}: not found, skipped")
+            continue
+        try:
+            convert(path)
+        except sqlite3.OperationalError as e:
+            print(f"❌ {path}: {e} (is the bot or the API still running?)")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    # Offline step: stop the bot and the API first. VACUUM needs free disk
+    # space about the size of the file and blocks all writers while it runs.
+    main()